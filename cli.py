@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+"""
+Command line control for Cantapyle, for scripts, cron jobs and
+hotkey daemons. Uses the same settings as the GUI, but never
+imports Qt.
+
+Examples:
+	cli.py next
+	cli.py add "Some Artist/Some Album"
+	cli.py status --json
+	cli.py --server 2 pause
+"""
+
+import argparse
+import json
+import sys
+from os import environ, path as os_path
+
+from player import PlayerObj, propertime, serverlist
+
+class SettingsFile(object):
+	"""
+	Read-only access to the settings the GUI saves
+	through QSettings (SettingsObj), without Qt.
+	"""
+	def value(self, key, default):
+		return self.values.get(key, default)
+	
+	def load_ini(self):
+		"""
+		QSettings uses an ini file on Linux and BSD.
+		"""
+		from configparser import RawConfigParser
+		
+		config = RawConfigParser()
+		config.optionxform = str # Keys are case sensitive
+		
+		confdir = environ.get(
+			"XDG_CONFIG_HOME",
+			os_path.expanduser("~/.config")
+		)
+		config.read(os_path.join(confdir, "Cantapyle Project", "Cantapyle.conf"))
+		
+		if not config.has_section("General"): return
+		
+		for key, value in config.items("General"):
+			# QSettings quotes strings containing commas etc.
+			if len(value) > 1 and value[0] == value[-1] == '"':
+				value = value[1:-1]
+			
+			self.values[key] = value
+	
+	def load_registry(self):
+		"""
+		QSettings uses the registry on Windows.
+		"""
+		import winreg
+		
+		try:
+			key = winreg.OpenKey(
+				winreg.HKEY_CURRENT_USER,
+				"Software\\Cantapyle Project\\Cantapyle"
+			)
+		except OSError: return
+		
+		num = 0
+		
+		while True:
+			try: name, value, kind = winreg.EnumValue(key, num)
+			except OSError: break
+			
+			self.values[name] = str(value)
+			num += 1
+	
+	@property
+	def server(self):
+		return environ.get("MPD_HOST", self.value("MPDServer", "127.0.0.1"))
+	
+	@property
+	def port(self):
+		return environ.get("MPD_PORT", self.value("MPDPort", "6600"))
+	
+	@property
+	def moreservers(self):
+		return self.value("MPDServers", "")
+	
+	@property
+	def servers(self):
+		return serverlist(self.server, self.port, self.moreservers)
+	
+	def __init__(self):
+		self.values = {}
+		
+		if sys.platform == "win32":
+			self.load_registry()
+		else:
+			self.load_ini()
+
+Settings = SettingsFile()
+
+
+
+def printsong(song):
+	"""
+	Print a song the way the GUI shows it in the playlist.
+	"""
+	if song.get("artist") and song.get("title"):
+		print("{0} - {1}".format(song["artist"], song["title"]))
+	# Tags missing
+	else:
+		print(song.get("file", ""))
+
+def cmd_status(player, args):
+	status = player.status()
+	song = player.currentsong()
+	
+	if args.json:
+		json.dump({"status": status, "song": song}, sys.stdout, indent=1)
+		print()
+		return
+	
+	state = status.get("state")
+	
+	if state != "stop" and song:
+		printsong(song)
+		
+		now, end = [int(i) for i in status["time"].split(":")]
+		
+		print("[{0}] #{1}/{2} {3} / {4}".format(
+			"playing" if state == "play" else "paused",
+			int(status["song"]) + 1,
+			status["playlistlength"],
+			propertime(now),
+			propertime(end)
+		))
+	else:
+		print("[stopped]")
+	
+	print("volume: {0}%".format(status.get("volume")))
+
+def cmd_current(player, args):
+	song = player.currentsong()
+	
+	if args.json:
+		json.dump(song, sys.stdout, indent=1)
+		print()
+	elif song:
+		printsong(song)
+
+def cmd_play(player, args):
+	if args.pos is not None:
+		player.play(args.pos - 1) # 1-based like the status output
+	else:
+		player.play()
+
+def cmd_pause(player, args):
+	player.pause(1)
+
+def cmd_toggle(player, args):
+	# Same as the GUI's play/pause button
+	if player.status().get("state") == "play":
+		player.pause(1)
+	else:
+		player.play()
+
+def cmd_stop(player, args):
+	player.stop()
+
+def cmd_next(player, args):
+	player.next()
+
+def cmd_prev(player, args):
+	player.previous()
+
+def cmd_add(player, args):
+	for uri in args.uri:
+		player.add(uri)
+
+def cmd_clear(player, args):
+	player.clear()
+
+def cmd_volume(player, args):
+	if args.value is None:
+		print(player.status().get("volume"))
+		return
+	
+	# Relative changes with a sign, e.g. +5 or -10
+	if args.value[0] in "+-":
+		vol = int(player.status().get("volume")) + int(args.value)
+	else:
+		vol = int(args.value)
+	
+	player.setvol(max(0, min(100, vol)))
+
+def cmd_update(player, args):
+	# Prints the job id
+	if args.uri:
+		print(player.update(args.uri))
+	else:
+		print(player.update())
+
+def cmd_servers(player, args):
+	for num, server in enumerate(Settings.servers, 1):
+		print("{0}: {1}:{2}".format(num, *server))
+
+def parser():
+	parser = argparse.ArgumentParser(description="Control MPD from the command line.")
+	parser.add_argument("-s", "--server", default="1",
+		help="server number from the settings (see 'servers') or host:port"
+	)
+	
+	commands = parser.add_subparsers(dest="command", metavar="command")
+	commands.required = True
+	
+	cmd = commands.add_parser("status", help="show what's playing")
+	cmd.add_argument("--json", action="store_true", help="print status as JSON")
+	cmd.set_defaults(run=cmd_status)
+	
+	cmd = commands.add_parser("current", help="show the current song")
+	cmd.add_argument("--json", action="store_true", help="print song as JSON")
+	cmd.set_defaults(run=cmd_current)
+	
+	cmd = commands.add_parser("play", help="start playing")
+	cmd.add_argument("pos", nargs="?", type=int, help="playlist position, 1 is the first song")
+	cmd.set_defaults(run=cmd_play)
+	
+	for name, run, text in (
+		("pause", cmd_pause, "pause playing"),
+		("toggle", cmd_toggle, "play or pause"),
+		("stop", cmd_stop, "stop playing"),
+		("next", cmd_next, "skip to next song"),
+		("prev", cmd_prev, "go to previous song"),
+		("clear", cmd_clear, "clear the playlist"),
+		("servers", cmd_servers, "list the configured servers")
+	):
+		commands.add_parser(name, help=text).set_defaults(run=run)
+	
+	cmd = commands.add_parser("add", help="add directories or files to the playlist")
+	cmd.add_argument("uri", nargs="+")
+	cmd.set_defaults(run=cmd_add)
+	
+	cmd = commands.add_parser("volume", help="show or set volume, e.g. 50, +5 or -5")
+	cmd.add_argument("value", nargs="?")
+	cmd.set_defaults(run=cmd_volume)
+	
+	cmd = commands.add_parser("update", help="update the MPD database")
+	cmd.add_argument("uri", nargs="?", help="directory to update, everything if left out")
+	cmd.set_defaults(run=cmd_update)
+	
+	return parser
+
+def main(argv=None):
+	args = parser().parse_args(argv)
+	
+	if args.command == "servers":
+		return args.run(None, args)
+	
+	if args.server.isdigit():
+		try: host, port = Settings.servers[int(args.server) - 1]
+		except IndexError:
+			sys.exit("No server number {0}".format(args.server))
+	else:
+		host, sep, port = args.server.rpartition(":")
+		
+		if not sep: host, port = args.server, Settings.port
+	
+	player = PlayerObj()
+	
+	try:
+		player.connect(host, port)
+		args.run(player, args)
+		player.disconnect()
+	except Exception as e:
+		sys.exit(str(e))
+
+
+
+if __name__ == "__main__":
+	main()
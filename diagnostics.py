@@ -0,0 +1,159 @@
+"""
+Memory diagnostics for long running sessions, e.g. kiosks.
+
+Allocations are traced with tracemalloc and sampled at an interval
+together with Qt object counts and the sizes the application reports
+for its models and caches. Every sample logs the growth since the
+start by allocation site, so leaks and caches that keep growing stand
+out after a few hours.
+
+Enabled with "main.py --diagnostics SECONDS".
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from PyQt5 import QtCore, sip
+
+def mib(size):
+	return "{0:.1f} MiB".format(size / 1048576)
+
+def wrappers():
+	"""
+	Count the Qt objects Python holds a wrapper for, by class.
+	Leaked items, pixmaps etc. created from Python show up here.
+	"""
+	counts = Counter()
+	
+	for obj in gc.get_objects():
+		if isinstance(obj, sip.simplewrapper):
+			counts[type(obj).__name__] += 1
+	
+	return counts
+
+def qobjects(root):
+	"""
+	Count the QObjects under root by class, including
+	the ones Python never saw.
+	"""
+	counts = Counter()
+	
+	for obj in root.findChildren(QtCore.QObject):
+		counts[obj.metaObject().className()] += 1
+	
+	return counts
+
+class MemoryMonitor(QtCore.QObject):
+	"""
+	Samples memory use with a timer and writes a report per sample.
+	"""
+	# Ignore the tracing machinery itself
+	filters = (
+		tracemalloc.Filter(False, tracemalloc.__file__),
+		tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+		tracemalloc.Filter(False, "<unknown>")
+	)
+	
+	def start(self, root, stats=None):
+		"""
+		Take the baseline and start sampling.
+		root is the object whose children are counted, stats returns
+		a dict of sizes the application wants logged.
+		"""
+		self.root = root
+		self.stats = stats or dict
+		
+		self.baseline = tracemalloc.take_snapshot().filter_traces(self.filters)
+		self.started = time.monotonic()
+		
+		self.timer.start(self.interval * 1000)
+	
+	def stop(self):
+		self.timer.stop()
+		tracemalloc.stop()
+		self.baseline = None
+	
+	def counts(self):
+		counts = Counter()
+		
+		for name, value in self.stats().items():
+			counts[name] = value
+		
+		for name, value in wrappers().items():
+			counts["python " + name] = value
+		
+		for name, value in qobjects(self.root).items():
+			counts["qt " + name] = value
+		
+		return counts
+	
+	def sample(self):
+		self.samples += 1
+		
+		snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+		growth = snapshot.compare_to(self.baseline, "lineno")
+		current, peak = tracemalloc.get_traced_memory()
+		
+		counts = self.counts()
+		
+		lines = [
+			"=== Memory sample {0}, {1:.0f} s ===".format(
+				self.samples,
+				time.monotonic() - self.started
+			),
+			"traced: {0} (peak {1})".format(mib(current), mib(peak)),
+			"growth since start by allocation site:"
+		]
+		
+		for stat in [stat for stat in growth if stat.size_diff > 0][:self.top]:
+			frame = stat.traceback[0]
+			
+			lines.append("  {0:>+10.1f} KiB {1:>+8} blocks  {2}:{3}".format(
+				stat.size_diff / 1024,
+				stat.count_diff,
+				frame.filename,
+				frame.lineno
+			))
+		
+		lines.append("counts (change since last sample):")
+		
+		for name in sorted(counts):
+			# Only the application's own sizes and Qt classes that moved
+			if name.startswith(("python ", "qt ")) and counts[name] == self.last.get(name):
+				continue
+			
+			lines.append("  {0:<40} {1:>8} ({2:+})".format(
+				name,
+				counts[name],
+				counts[name] - self.last.get(name, 0)
+			))
+		
+		self.last = counts
+		
+		print("\n".join(lines), file=self.log, flush=True)
+	
+	def __init__(self, interval=60, log=sys.stderr, frames=1, top=10):
+		super(MemoryMonitor, self).__init__()
+		
+		self.interval = interval
+		self.log = log
+		self.top = top
+		
+		# Started right away, so everything created
+		# after the import is traced.
+		if not tracemalloc.is_tracing():
+			tracemalloc.start(frames)
+		
+		self.root = None
+		self.stats = dict
+		self.baseline = None
+		self.started = time.monotonic()
+		
+		self.samples = 0
+		self.last = Counter()
+		
+		self.timer = QtCore.QTimer(self)
+		self.timer.timeout.connect(self.sample)
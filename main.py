@@ -2,16 +2,396 @@
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
-from mpd import MPDClient
+from player import PlayerObj, propertime, record, serverlist
+from mpd import CommandError
 from os import path as os_path
+import argparse
+import random
+import sys
+import time
+from collections import Counter, OrderedDict
+from itertools import islice
 
-class Playlist(object):
+class Tags(str):
+	"""
+	A multi-value tag, joined for display. The values are
+	kept apart for filters, MPD matches each on its own.
+	"""
+	def __new__(cls, values):
+		self = super(Tags, cls).__new__(cls, ", ".join(values))
+		self.values = [sys.intern(value) for value in values]
+		
+		return self
+
+def tag(value):
+	"""
+	Normalize a tag value from MPD.
+	Multi-value tags are joined and the result is interned
+	so repeating artists and albums only exist in memory once.
+	"""
+	if value is None:
+		return None
+	
+	if isinstance(value, list):
+		return Tags(value)
+	
+	return sys.intern(value)
+
+def tagfilter(name, value):
+	"""
+	Filter arguments for songs with a tag value as
+	Song has it, every value of a multi-value tag.
+	"""
+	filt = ()
+	
+	for value in getattr(value, "values", [value]):
+		filt += (name, value)
+	
+	return filt
+
+def number(value, default=0):
+	"""
+	Parse the leading number of an MPD value,
+	e.g. track "3/12" or duration "241.320".
+	"""
+	if isinstance(value, list):
+		value = value[0]
+	
+	try: return int(float(str(value).split("/")[0]))
+	except ValueError: return default
+
+class Song(object):
+	"""
+	Compact record for a single song.
+	Replaces the raw dict python-mpd returns, the dict-like
+	get() and [] keep existing lookups working.
+	"""
+	__slots__ = (
+		"file", "title", "artist", "album", "albumartist",
+		"disc", "track", "time", "pos", "id"
+	)
+	
+	def get(self, key, default=None):
+		value = getattr(self, key, None)
+		
+		return default if value is None else value
+	
+	def __getitem__(self, key):
+		value = self.get(key)
+		
+		if value is None:
+			raise KeyError(key)
+		
+		return value
+	
+	def __init__(self, item={}):
+		self.file = item.get("file")
+		self.title = item.get("title")
+		
+		if isinstance(self.title, list):
+			self.title = ", ".join(self.title)
+		
+		self.artist = tag(item.get("artist"))
+		self.album = tag(item.get("album"))
+		self.albumartist = tag(item.get("albumartist"))
+		
+		# Parse numbers once instead of on every redraw
+		self.disc = number(item.get("disc", 0))
+		self.track = number(item.get("track", 0))
+		self.time = number(item.get("time", item.get("duration", 0)))
+		self.pos = number(item.get("pos", -1), -1)
+		self.id = number(item.get("id", -1), -1)
+
+class Directory(object):
+	"""
+	Compact record for a single directory in the library.
+	"""
+	__slots__ = ("directory",)
+	
+	get = Song.get
+	__getitem__ = Song.__getitem__
+	
+	def __init__(self, directory=""):
+		self.directory = directory
+
+class Album(object):
+	"""
+	An album in the cover grid, file is one of its
+	songs once it has been looked up.
+	"""
+	__slots__ = ("artist", "album", "file")
+	
+	def __init__(self, artist, album):
+		self.artist = artist
+		self.album = album
+		self.file = None
+
+
+
+class TimeIndex(object):
+	"""
+	Song times by playlist position in a Fenwick tree. The time of
+	the songs before a position and changing the time at one both
+	take O(log n), instead of a pass over the playlist.
+	"""
+	def before(self, pos):
+		"""
+		Total time of the songs before pos.
+		"""
+		total = 0
+		
+		while pos > 0:
+			total += self.tree[pos]
+			pos -= pos & -pos
+		
+		return total
+	
+	def total(self):
+		return self.before(len(self.values))
+	
+	def set(self, pos, value):
+		delta = value - self.values[pos]
+		self.values[pos] = value
+		
+		pos += 1
+		
+		while pos < len(self.tree):
+			self.tree[pos] += delta
+			pos += pos & -pos
+	
+	def append(self, value):
+		self.values.append(value)
+		
+		# Node pos sums the low values up to and including pos
+		pos = len(self.values)
+		low = pos & -pos
+		
+		self.tree.append(value + self.before(pos - 1) - self.before(pos - low))
+	
+	def resize(self, length):
+		"""
+		Cut off songs at the end or add songs of no time.
+		"""
+		old = len(self.values)
+		
+		del self.values[length:]
+		del self.tree[length + 1:]
+		
+		if length <= old: return
+		
+		self.values.extend([0] * (length - old))
+		self.tree.extend([0] * (length - old))
+		
+		# Only the new nodes that reach back over the old songs have a sum
+		pos = old
+		
+		while pos:
+			pos += pos & -pos
+			
+			if pos > length: break
+			
+			self.tree[pos] = self.before(old) - self.before(pos - (pos & -pos))
+	
+	def rebuild(self, values):
+		"""
+		Start over from a list of times, in O(n).
+		"""
+		self.values = list(values)
+		self.tree = [0] + self.values
+		
+		for pos in range(1, len(self.tree)):
+			parent = pos + (pos & -pos)
+			
+			if parent < len(self.tree):
+				self.tree[parent] += self.tree[pos]
+	
+	def __init__(self):
+		self.values = []
+		self.tree = [0] # 1-based
+
+
+
+class PlaylistObj(object):
 	"""
 	Simple playlist object to contain the
 	current playlist.
+	
+	Playlists too long to hold every song's tags are windowed:
+	all songs are stubs with only an id and position, the tags
+	of windows of rows are fetched as they come into view and
+	the least recently used windows go back to stubs.
+	
+	The totals shown for the playlist are kept up to date with
+	every change, so they never take a pass over all songs.
 	"""
+	windowsize = 200
+	windowlimit = 50
+	
 	def add(self, items = []):
-		self.items = items
+		self.items = []
+		self.ids = {}
+		self.windows = OrderedDict()
+		self.times = TimeIndex()
+		self.artists = Counter()
+		
+		self.extend(items)
+	
+	def count(self, song, step):
+		"""
+		Count a song's artist in or out of the totals.
+		"""
+		if song is None or not song.artist: return
+		
+		self.artists[song.artist] += step
+		
+		if not self.artists[song.artist]:
+			del self.artists[song.artist]
+	
+	def put(self, pos, song):
+		"""
+		Replace the entry at pos, keeping the totals up to date.
+		"""
+		self.count(self.items[pos], -1)
+		self.count(song, 1)
+		
+		self.items[pos] = song
+		self.times.set(pos, song.time if song is not None else 0)
+	
+	def extend(self, items = []):
+		"""
+		Append entries to the end of the playlist,
+		used when the playlist is streamed in chunks.
+		"""
+		for item in items:
+			song = Song(item)
+			
+			# Songid -> position, for O(1) lookups by id
+			self.ids[song.id] = len(self.items)
+			self.items.append(song)
+			
+			self.times.append(song.time)
+			self.count(song, 1)
+	
+	def change(self, length, songs = []):
+		"""
+		Apply a diff as plchanges describes it, songs are
+		the entries at positions that changed and the
+		playlist is cut or extended to length.
+		"""
+		for song in self.items[length:]:
+			self.count(song, -1)
+		
+		del self.items[length:]
+		self.items.extend([None] * (length - len(self.items)))
+		self.times.resize(length)
+		
+		for song in songs:
+			self.put(song.pos, song)
+		
+		# Rows still empty are filled by place()
+		self.ids = {
+			song.id: pos for pos, song in enumerate(self.items)
+			if song is not None
+		}
+	
+	def stub(self, pos, songid):
+		"""
+		A song known only by position and id. Made without
+		Song.__init__, there's nothing to parse for millions of them.
+		"""
+		song = Song.__new__(Song)
+		song.file = song.title = song.artist = None
+		song.album = song.albumartist = None
+		song.disc = song.track = song.time = 0
+		song.pos = pos
+		song.id = songid
+		
+		return song
+	
+	def place(self, items):
+		"""
+		Put stubs for the songs plchangesposid lists into
+		the rows change() made, returns how many there were.
+		"""
+		count = 0
+		
+		for item in items:
+			pos = int(item["cpos"])
+			songid = int(item["id"])
+			
+			self.items[pos] = self.stub(pos, songid)
+			self.ids[songid] = pos
+			count += 1
+		
+		return count
+	
+	def stubbed(self, start, end):
+		"""
+		Whether any song from start up to end has no tags yet.
+		"""
+		return any(
+			song is None or song.file is None
+			for song in self.items[start:end]
+		)
+	
+	def fill(self, window, songs):
+		"""
+		Put the fetched songs of a window in place of their stubs,
+		the rows that were filled are returned. The oldest windows
+		beyond windowlimit are stubbed again.
+		"""
+		rows = []
+		
+		for song in songs:
+			row = self.ids.get(song.id)
+			
+			if row is None: continue # Gone meanwhile
+			
+			song.pos = row
+			self.put(row, song)
+			rows.append(row)
+		
+		self.windows[window] = [song.id for song in songs]
+		self.windows.move_to_end(window)
+		
+		while len(self.windows) > self.windowlimit:
+			old, songids = self.windows.popitem(last = False)
+			
+			for songid in songids:
+				row = self.ids.get(songid)
+				
+				if row is not None:
+					self.put(row, self.stub(row, songid))
+		
+		return rows
+	
+	def touch(self, window):
+		"""
+		Mark a window as recently used.
+		"""
+		if window in self.windows:
+			self.windows.move_to_end(window)
+	
+	def remove(self, start, end):
+		"""
+		Drop the entries from start up to end, renumber()
+		has to follow once all removals are done.
+		"""
+		for song in self.items[start:end]:
+			self.count(song, -1)
+		
+		del self.items[start:end]
+	
+	def renumber(self, first = 0):
+		"""
+		Fix positions and the id lookup after
+		entries from first on shifted.
+		"""
+		for pos in range(first, len(self.items)):
+			self.items[pos].pos = pos
+		
+		self.ids = {song.id: pos for pos, song in enumerate(self.items)}
+		self.times.rebuild(song.time for song in self.items)
 	
 	def get(self, num = None):
 		if num != None:
@@ -19,41 +399,88 @@ class Playlist(object):
 		else:
 			return(self.items)
 	
+	def row(self, songid):
+		"""
+		Get the position of a song by its songid,
+		None if it isn't in the playlist.
+		"""
+		return self.ids.get(songid)
+	
 	def reset(self):
 		self.items = []
+		self.ids = {}
+		self.windows = OrderedDict()
+		self.times = TimeIndex()
+		self.artists = Counter()
+		self.windowed = False
 		self.lastversion = 0
 	
 	def __init__(self):
 		self.items = []
+		self.ids = {}
+		
+		# Window number -> songids of the windows that have tags
+		self.windows = OrderedDict()
+		self.windowed = False
+		
+		# Totals: song times by position and songs per artist
+		self.times = TimeIndex()
+		self.artists = Counter()
 		
 		# Save the last playlist version so
 		# Playlist changes are detectable.
 		self.lastversion = 0
 
-Playlist = Playlist()
+Playlist = PlaylistObj()
 
 
 
-class Library(object):
+class LibraryObj(object):
 	"""
 	Simple library object to contain the
-	current MPD library view.
+	current MPD library view. Listings that were
+	shown before are cached per directory.
 	"""
-	def add(self, items = []):
+	def add(self, items = [], root = None):
 		dirs = [
-			{"directory" : ""},
-			{"directory" : ".."}
+			Directory(""),
+			Directory("..")
 		]
 		fils = []
 		
 		for item in items:
 			if item.get("directory"):
-				dirs.append(item)
-			else:
-				fils.append(item)
+				dirs.append(Directory(item["directory"]))
+			elif item.get("file"):
+				fils.append(Song(item))
+			# Stored playlists are skipped
 		
 		dirs.extend(fils)
 		self.items = dirs
+		
+		if root != None:
+			self.listings[root] = dirs
+	
+	def load(self, root):
+		"""
+		Show a cached listing, False if it isn't cached.
+		"""
+		if root not in self.listings: return False
+		
+		self.items = self.listings[root]
+		
+		return True
+	
+	def invalidate(self, path):
+		"""
+		Drop the cached listings an update of path can change,
+		path itself, everything under it and its parent.
+		"""
+		parent = path.rpartition("/")[0]
+		
+		for root in list(self.listings):
+			if not path or root in (path, parent) or root.startswith(path + "/"):
+				del self.listings[root]
 	
 	def get(self, num = None):
 		if num != None:
@@ -64,13 +491,124 @@ class Library(object):
 	def reset(self):
 		self.items = []
 		self.lastroot = ""
+		self.listings = {}
+		self.jobs = {}
 	
 	def __init__(self):
 		self.items = []
 		# Save the last location into this so ".." works
 		self.lastroot = ""
+		
+		# Directory -> listing
+		self.listings = {}
+		
+		# Running update jobs, job id -> path
+		self.jobs = {}
+
+Library = LibraryObj()
+
+
+
+class StoredPlaylistsObj(object):
+	"""
+	Simple object to contain the stored playlists on
+	the server. Their songs are only fetched when needed
+	and cached until the playlist is modified.
+	"""
+	def add(self, items = []):
+		self.items = [
+			(item["playlist"], item.get("last-modified", ""))
+			for item in items
+		]
+	
+	def get(self, num = None):
+		if num != None:
+			return(self.items[num])
+		else:
+			return(self.items)
+	
+	def songs(self, name, modified):
+		"""
+		Cached songs of a playlist, None if not cached
+		or the playlist changed since.
+		"""
+		cached = self.cache.get(name)
+		
+		if cached and cached[0] == modified:
+			return cached[1]
+	
+	def store(self, name, modified, items = []):
+		self.cache[name] = (modified, [Song(item) for item in items])
+		
+		return self.cache[name][1]
+	
+	def reset(self):
+		self.items = []
+		self.cache = {}
+	
+	def __init__(self):
+		self.items = []
+		
+		# Name -> (last-modified, songs)
+		self.cache = {}
+
+StoredPlaylists = StoredPlaylistsObj()
+
+
+
+class TagCacheObj(object):
+	"""
+	Cache for the tag browser. Every node's children are
+	cached by the node's filter, e.g. ("albumartist", "X"),
+	until the database version changes.
+	"""
+	def get(self, filt):
+		return self.cache.get(filt)
+	
+	def store(self, filt, children):
+		self.cache[filt] = children
+		
+		return children
+	
+	def check(self, dbversion):
+		"""
+		Drop everything when the database has been updated.
+		"""
+		if dbversion != self.dbversion:
+			self.cache = {}
+			self.dbversion = dbversion
+	
+	def reset(self):
+		self.cache = {}
+		self.dbversion = None
+	
+	def __init__(self):
+		# Filter -> [(text, child filter), ...]
+		self.cache = {}
+		
+		# The "db_update" value from stats
+		self.dbversion = None
+
+TagCache = TagCacheObj()
 
-Library = Library()
+def grouped(items, group, key):
+	"""
+	Turn the reply of a grouped list query, e.g.
+	"list album group albumartist", into {group: [values]}.
+	python-mpd returns either one dict per pair or
+	one dict per group with a list of values.
+	"""
+	result = {}
+	
+	for item in items:
+		values = item.get(key, [])
+		
+		if not isinstance(values, list):
+			values = [values]
+		
+		result.setdefault(item.get(group, ""), []).extend(values)
+	
+	return result
 
 
 
@@ -157,58 +695,451 @@ class SettingsObj(QtCore.QSettings):
 	@autoconn.setter
 	def autoconn(self, val):
 		self.setValue("AutoConn", val)
+	
+	@property
+	def moreservers(self):
+		"""
+		Additional servers for multi-server mode,
+		comma separated "host:port" entries.
+		"""
+		return str(self.value(
+			"MPDServers",
+			""
+		))
+	
+	@moreservers.setter
+	def moreservers(self, servers):
+		self.setValue("MPDServers", servers)
+	
+	@property
+	def servers(self):
+		"""
+		All configured servers as (host, port) pairs,
+		the main server is always first.
+		"""
+		return serverlist(self.server, self.port, self.moreservers)
 
 Settings = SettingsObj()
 
 
 
-class PlayerObj(MPDClient):
+Player = PlayerObj()
+
+
+
+def coverpath(file):
 	"""
-	Wrapper for the MPDClient object.
+	Local path of the cover for a song or directory.
 	"""
-	def connect(self, host, port):
-		super(PlayerObj, self).connect(host, port)
-		self.connected = True
+	return os_path.join(Settings.musicdir, os_path.dirname(file), "cover.jpg")
 
-	def disconnect(self):
-		self.connected = False
-		super(PlayerObj, self).disconnect()
-	
-	def reset(self):
-		self.lastsong = -1
-		self.laststate = None
+class CoverJob(QtCore.QRunnable):
+	"""
+	Read and scale one cover on the thread pool. Images
+	are decoded at the requested size, not full size.
+	"""
+	def run(self):
+		path, size = self.key
+		
+		reader = QtGui.QImageReader(path)
+		image = QtGui.QImage()
+		
+		if not self.cancelled and reader.canRead():
+			reader.setScaledSize(
+				reader.size().scaled(size, size, QtCore.Qt.KeepAspectRatio)
+			)
+			image = reader.read()
+		
+		# Always reported, the loader lets go of the job then
+		self.loader.decoded.emit(self, image)
 	
-	def __init__(self):
-		super(PlayerObj, self).__init__()
+	def __init__(self, loader, key):
+		super(CoverJob, self).__init__()
+		
+		# Owned by the loader, the pool must not delete it
+		self.setAutoDelete(False)
+		
+		self.loader = loader
+		self.key = key
+		self.cancelled = False
 
-		self.timeout = 10 # Timeout for connecting
+class CoverLoaderObj(QtCore.QObject):
+	"""
+	Loads cover thumbnails in the background and keeps
+	a bounded number of them, least recently used go first.
+	Missing covers are cached as null pixmaps.
+	"""
+	# Emitted in the GUI thread once a cover is cached
+	loaded = QtCore.pyqtSignal(object)
+	
+	# Emitted by the jobs from the pool threads
+	decoded = QtCore.pyqtSignal(object, QtGui.QImage)
+	
+	def get(self, path, size):
+		"""
+		Return the cached cover, or None and load it.
+		"""
+		key = (path, size)
+		pixmap = self.cache.get(key)
+		
+		if pixmap is not None:
+			self.cache.move_to_end(key)
+			return pixmap
+		
+		if key not in self.pending:
+			job = CoverJob(self, key)
+			self.pending[key] = job
+			self.pool.start(job)
+	
+	def cancel(self, keys):
+		"""
+		Drop requests that are no longer needed,
+		queued ones never start, running ones aren't stored.
+		"""
+		for key in keys:
+			job = self.pending.pop(key, None)
+			
+			if job is None: continue
+			
+			job.cancelled = True
+			
+			# Running ones are kept until they report back
+			if not self.pool.tryTake(job):
+				self.dropped.add(job)
+	
+	def store(self, job, image):
+		self.dropped.discard(job)
+		
+		key = job.key
+		
+		if job.cancelled or self.pending.get(key) is not job: return
+		
+		del self.pending[key]
+		
+		self.cache[key] = QtGui.QPixmap.fromImage(image)
+		
+		while len(self.cache) > self.limit:
+			self.cache.popitem(last=False)
 		
-		# Used to detect when song changes,
-		# Updated by GUI timer.
-		self.lastsong = -1
+		self.loaded.emit(key)
+	
+	def __init__(self, limit=500):
+		super(CoverLoaderObj, self).__init__()
+		
+		# (path, size) -> QPixmap
+		self.cache = OrderedDict()
+		self.limit = limit
 		
-		# Used to detect when MPD state changes.
-		# (Playing,Paused,Stopped).
-		# Updated by GUI timer.
-		self.laststate = None
+		# (path, size) -> CoverJob
+		self.pending = {}
 		
-		self.connected = False
+		# Cancelled jobs that were already running
+		self.dropped = set()
+		
+		self.pool = QtCore.QThreadPool()
+		self.decoded.connect(self.store)
 
-Player = PlayerObj()
+CoverLoader = CoverLoaderObj()
 
 
 
-# This would support displaying hours, not what I want currently.
-#def propertime(secs = 0):
-	#m, s = divmod(secs, 60)
-	#h, m = divmod(m, 60)
+class EventBusObj(QtCore.QObject):
+	"""
+	Turns status of the active server into typed change events.
 	
-	#return "%02d:%02d:%02d" % (h, m, s) if h else "%d:%02d" % (m, s)
-
-# Turn seconds into M:SS format.
-def propertime(sec=0): return "{0}:{1:02d}".format(int(sec / 60), sec % 60)
-
-def require_connected(func):
+	Every status fetched, by the timer or by the idle connection,
+	is published here and compared to the previous one, only what
+	changed is emitted. Widgets and caches connect to the signals
+	they care about, and read the latest status from Bus.status
+	instead of asking MPD again.
+	"""
+	# Signals are emitted in this order
+	playlist = QtCore.pyqtSignal(str, int) # version, length
+	song = QtCore.pyqtSignal(int) # songid, -1 if none
+	nextsong = QtCore.pyqtSignal(int) # songid, -1 if none
+	state = QtCore.pyqtSignal(str) # play, pause or stop
+	elapsed = QtCore.pyqtSignal(int, int) # seconds played, length
+	volume = QtCore.pyqtSignal(int) # -1 without mixer
+	updating = QtCore.pyqtSignal(int) # job id, 0 when done
+	
+	# Only known from idle events
+	database = QtCore.pyqtSignal()
+	storedlists = QtCore.pyqtSignal()
+	
+	def publish(self, status, changed=()):
+		"""
+		Make status the current one and emit what changed,
+		changed are the subsystems from an idle event.
+		"""
+		old = self.status
+		self.status = status
+		
+		if self.held:
+			self.changed.update(changed)
+			return
+		
+		# Stops once a handler lost the connection and reset
+		def differs(key):
+			return self.status is status and status.get(key) != old.get(key)
+		
+		if differs("playlist"):
+			self.playlist.emit(
+				status.get("playlist", ""),
+				int(status.get("playlistlength", "0"))
+			)
+		
+		if differs("songid"):
+			self.song.emit(int(status.get("songid", "-1")))
+		
+		if differs("nextsongid"):
+			self.nextsong.emit(int(status.get("nextsongid", "-1")))
+		
+		if differs("state"):
+			self.state.emit(status.get("state", "stop"))
+		
+		# Missing when stopped
+		if differs("time") and "time" in status:
+			now, end = [int(i) for i in status["time"].split(":")]
+			self.elapsed.emit(now, end)
+		
+		if differs("volume"):
+			self.volume.emit(int(status.get("volume", "-1")))
+		
+		if differs("updating_db"):
+			self.updating.emit(int(status.get("updating_db", "0")))
+		
+		if "database" in changed and self.status is status:
+			self.database.emit()
+		
+		if "stored_playlist" in changed and self.status is status:
+			self.storedlists.emit()
+	
+	def set(self, key, value):
+		"""
+		Change one value of the current status, e.g.
+		right after setting it, and emit the change.
+		"""
+		status = dict(self.status)
+		status[key] = value
+		
+		self.publish(status)
+	
+	def hold(self):
+		"""
+		Stop emitting, e.g. while the window is hidden.
+		Status is still kept up to date.
+		"""
+		if self.held: return
+		
+		self.held = True
+		self.shown = self.status
+		self.changed = set()
+	
+	def release(self):
+		"""
+		Emit everything that changed while held in one go,
+		as if it all happened at once.
+		"""
+		if not self.held: return
+		
+		self.held = False
+		status = self.status
+		self.status = self.shown
+		
+		self.publish(status, self.changed)
+	
+	def reset(self):
+		"""
+		Forget the status, the next one is emitted in full.
+		"""
+		self.status = {}
+		self.shown = {}
+	
+	def __init__(self):
+		super(EventBusObj, self).__init__()
+		
+		# Latest status of the active server
+		self.status = {}
+		
+		# While held, the status last emitted
+		# and the idle events since.
+		self.held = False
+		self.shown = {}
+		self.changed = set()
+
+Bus = EventBusObj()
+
+
+
+class ConnectJob(QtCore.QRunnable):
+	"""
+	Open a connection on the thread pool, servers that don't
+	answer would block the GUI until the connection times out.
+	signal is emitted with args and whether it connected.
+	"""
+	# Jobs mostly wait for the network, one thread per server
+	pool = QtCore.QThreadPool()
+	pool.setMaxThreadCount(32)
+	
+	def run(self):
+		try:
+			self.client.connect(self.host, self.port)
+			opened = True
+		except Exception:
+			opened = False
+		
+		# The receiver is gone if the application quit meanwhile
+		try: self.signal.emit(*self.args + (opened,))
+		except RuntimeError: pass
+	
+	def __init__(self, client, host, port, signal, *args):
+		super(ConnectJob, self).__init__()
+		
+		self.client = client
+		self.host = host
+		self.port = port
+		self.signal = signal
+		self.args = args
+
+class IdleWatcher(QtCore.QObject):
+	"""
+	Keeps a connection to MPD in idle mode and reports
+	changed subsystems without polling.
+	The socket is watched by the Qt event loop, so any number
+	of servers can be watched from the GUI thread.
+	"""
+	changed = QtCore.pyqtSignal(list)
+	lost = QtCore.pyqtSignal()
+	
+	# Emitted by ConnectJob with whether it connected
+	opened = QtCore.pyqtSignal(bool)
+	
+	def start(self, host, port):
+		"""
+		Connect in the background, changed is emitted
+		once watching started, lost if it failed.
+		"""
+		self.client = PlayerObj()
+		self.stopped = False
+		
+		ConnectJob.pool.start(ConnectJob(self.client, host, port, self.opened))
+	
+	def watch(self, opened):
+		"""
+		Start watching the connection ConnectJob opened.
+		"""
+		if self.stopped:
+			try: self.client.disconnect()
+			except Exception: pass
+			return
+		
+		if not opened:
+			self.lost.emit()
+			return
+		
+		try:
+			# Status is cached on every change
+			self.status = self.client.status()
+			
+			# Iterate mode only sends "idle" and returns,
+			# the reply is read once the socket is readable.
+			self.client.iterate = True
+			self.pending = self.client.idle()
+		except Exception:
+			try: self.client.disconnect()
+			except Exception: pass
+			
+			self.lost.emit()
+			return
+		
+		self.notifier = QtCore.QSocketNotifier(
+			self.client.fileno(),
+			QtCore.QSocketNotifier.Read,
+			self
+		)
+		self.notifier.activated.connect(self.fetch)
+		
+		self.changed.emit([])
+	
+	def fetch(self):
+		"""
+		Read the idle reply, refresh the cached status and go idle again.
+		"""
+		self.notifier.setEnabled(False)
+		
+		try:
+			subsystems = list(self.pending)
+			
+			self.client.iterate = False
+			self.status = self.client.status()
+			self.client.iterate = True
+			
+			self.pending = self.client.idle()
+		except Exception:
+			self.stop()
+			self.lost.emit()
+			return
+		
+		self.notifier.setEnabled(True)
+		self.changed.emit(subsystems)
+	
+	def stop(self):
+		# Still connecting, watch() drops the connection
+		self.stopped = True
+		
+		if not self.notifier: return
+		
+		self.notifier.setEnabled(False)
+		self.notifier.deleteLater()
+		self.notifier = None
+		
+		# Dropping the connection also ends idle mode
+		try: self.client.disconnect()
+		except Exception: pass
+		
+		self.pending = None
+	
+	def __init__(self, parent=None):
+		super(IdleWatcher, self).__init__(parent)
+		
+		self.client = None
+		self.notifier = None
+		self.pending = None
+		self.status = {}
+		self.stopped = False
+		
+		self.opened.connect(self.watch)
+
+
+
+class Server(object):
+	"""
+	One MPD server in multi-server mode.
+	Every server keeps its own Player, Playlist and Library
+	so switching between them is served from the cache.
+	"""
+	def name(self):
+		return "{0}:{1}".format(self.host, self.port)
+	
+	def __init__(self, host, port):
+		self.host = host
+		self.port = port
+		
+		self.player = PlayerObj()
+		self.playlist = PlaylistObj()
+		self.library = LibraryObj()
+		self.storedlists = StoredPlaylistsObj()
+		self.tagcache = TagCacheObj()
+		
+		# Push updates and cached status for this server
+		self.watcher = IdleWatcher()
+		
+		# The command connection is being opened, see switch_server()
+		self.connecting = False
+
+
+
+def require_connected(func):
 	def run(*args, **kwargs):
 		#print("args: %s, %s") % (repr(args), repr(kwargs))
 		if Player.connected:
@@ -220,275 +1151,1883 @@ def require_connected(func):
 				)
 				mwin.disconnect_mpd()
 		else:
-			QtWidgets.QMessageBox.warning(mwin, "Not connected", "Not connected!")
-
-	return(run)
-
-class MainWindow(QtWidgets.QMainWindow):
-	def toggle_visibility(self):
+			QtWidgets.QMessageBox.warning(mwin, "Not connected", "Not connected!")
+	
+	return(run)
+
+def longtime(sec=0):
+	"""
+	Like propertime, with hours for playlist totals.
+	"""
+	hours, sec = divmod(sec, 3600)
+	
+	if not hours: return propertime(sec)
+	
+	return "{0}:{1:02d}:{2:02d}".format(hours, sec // 60, sec % 60)
+
+def songtext(item):
+	"""
+	Text a song is listed with.
+	"""
+	artist = item.get("artist", False)
+	title = item.get("title", False)
+	
+	if all([artist, title]):
+		return "{0} - {1}".format(artist, title)
+	# Tags missing
+	else:
+		return item["file"]
+
+def increasing(seq):
+	"""
+	Indices of a longest increasing subsequence of seq,
+	by patience sorting in O(n log n).
+	"""
+	tails = [] # Index of the smallest tail per length
+	prev = [None] * len(seq)
+	
+	for num, value in enumerate(seq):
+		lo, hi = 0, len(tails)
+		
+		while lo < hi:
+			mid = (lo + hi) // 2
+			
+			if seq[tails[mid]] < value: lo = mid + 1
+			else: hi = mid
+		
+		prev[num] = tails[lo - 1] if lo else None
+		
+		if lo == len(tails): tails.append(num)
+		else: tails[lo] = num
+	
+	found = []
+	num = tails[-1] if tails else None
+	
+	while num is not None:
+		found.append(num)
+		num = prev[num]
+	
+	return found[::-1]
+
+def albumkey(song):
+	"""
+	The album a song belongs to, songs without
+	an album tag are an album of their own.
+	"""
+	if not song.album: return ("", "", song.file)
+	
+	return (
+		(song.albumartist or song.artist or "").lower(),
+		song.album.lower(),
+		""
+	)
+
+def moveplan(old, new):
+	"""
+	The moves, as (songid, position), that rearrange the songids
+	in old into the order of new. Songs on a longest increasing
+	subsequence keep their place, every other song is moved once,
+	right behind the song it follows in new.
+	"""
+	where = {songid: pos for pos, songid in enumerate(old)}
+	seq = [where[songid] for songid in new]
+	keep = set(increasing(seq))
+	
+	# Fenwick tree over the old positions of the songs still to be
+	# moved, those are the only ones not where new puts them.
+	tree = [0] * (len(old) + 1)
+	
+	def toggle(pos, step):
+		pos += 1
+		
+		while pos < len(tree):
+			tree[pos] += step
+			pos += pos & -pos
+	
+	def before(pos):
+		count = 0
+		
+		while pos > 0:
+			count += tree[pos]
+			pos -= pos & -pos
+		
+		return count
+	
+	for num in range(len(new)):
+		if num not in keep: toggle(seq[num], 1)
+	
+	moves = []
+	anchor = 0 # Old position of the last song that stays
+	
+	for num, songid in enumerate(new):
+		if num in keep:
+			anchor = seq[num]
+			continue
+		
+		# Behind the songs placed so far and
+		# the unmoved ones before the anchor.
+		toggle(seq[num], -1)
+		moves.append((songid, num + before(anchor)))
+	
+	return moves
+
+class PlaylistModel(QtCore.QAbstractTableModel):
+	"""
+	Table model showing the songs in Playlist.
+	
+	Rows are read straight from the Playlist records, the
+	current song is exposed through CurrentRole (and bolded
+	through FontRole) instead of mutating per-item fonts.
+	"""
+	CurrentRole = QtCore.Qt.UserRole + 1
+	
+	# Asked for every row on each layout, the tree view
+	# skips looking for children with ItemNeverHasChildren.
+	rowflags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | \
+		QtCore.Qt.ItemIsDragEnabled | QtCore.Qt.ItemNeverHasChildren
+	
+	# Rows dragged within the playlist view
+	RowsMime = "application/x-cantapyle-rows"
+	
+	# Emitted with the dragged rows and the row they're dropped before,
+	# the move itself is left to the window.
+	dropped = QtCore.pyqtSignal(list, int)
+	
+	def rowCount(self, parent=QtCore.QModelIndex()):
+		if parent.isValid(): return 0
+		
+		return len(Playlist.get())
+	
+	def columnCount(self, parent=QtCore.QModelIndex()):
+		if parent.isValid(): return 0
+		
+		return 2
+	
+	def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+		if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+			if section == 0 and Playlist.get():
+				return self.summary()
+			
+			return ("Song", "Len")[section]
+	
+	def summary(self):
+		"""
+		The playlist totals, the time left counts the songs
+		after the current one. Playlist keeps them up to date,
+		so this is cheap enough for every header repaint.
+		"""
+		songs = len(Playlist.get())
+		
+		# Only the tags of the windows in view are known
+		if Playlist.windowed:
+			return "{0} songs".format(songs)
+		
+		total = Playlist.times.total()
+		row = Playlist.row(self.currentid)
+		
+		left = total - Playlist.times.before(row + 1) if row is not None else total
+		
+		return "{0} songs, {1} artists, {2} ({3} left)".format(
+			songs,
+			len(Playlist.artists),
+			longtime(total),
+			longtime(left)
+		)
+	
+	def totals_changed(self):
+		self.headerDataChanged.emit(QtCore.Qt.Horizontal, 0, 0)
+	
+	def flags(self, index):
+		# Drops only go between rows
+		if not index.isValid(): return QtCore.Qt.ItemIsDropEnabled
+		
+		return self.rowflags
+	
+	def supportedDropActions(self):
+		return QtCore.Qt.MoveAction
+	
+	def mimeTypes(self):
+		return [self.RowsMime]
+	
+	def mimeData(self, indexes):
+		data = QtCore.QMimeData()
+		rows = sorted(set(index.row() for index in indexes))
+		
+		data.setData(self.RowsMime, ",".join(map(str, rows)).encode())
+		
+		return data
+	
+	def dropMimeData(self, data, action, row, column, parent):
+		if not data.hasFormat(self.RowsMime): return False
+		
+		if row < 0:
+			row = parent.row() if parent.isValid() else self.rowCount()
+		
+		rows = [int(num) for num in bytes(data.data(self.RowsMime)).decode().split(",")]
+		self.dropped.emit(rows, row)
+		
+		# The view has nothing left to remove, the rows
+		# were moved in place.
+		return False
+	
+	def data(self, index, role=QtCore.Qt.DisplayRole):
+		if not index.isValid(): return None
+		
+		item = Playlist.get(index.row())
+		
+		if role == QtCore.Qt.DisplayRole:
+			# Tags not fetched yet, see PlaylistObj
+			if item is None or item.file is None: return None
+			
+			if index.column() == 1:
+				return propertime(item.time)
+			
+			return songtext(item)
+		
+		elif item is None:
+			return None
+		
+		elif role == self.CurrentRole:
+			return item.id == self.currentid
+		
+		elif role == QtCore.Qt.FontRole:
+			if index.column() == 0 and item.id == self.currentid:
+				return self.boldfont
+	
+	def extend(self, items=[]):
+		"""
+		Append entries to Playlist and the model.
+		"""
+		items = list(items)
+		
+		if not items: return
+		
+		first = len(Playlist.get())
+		
+		self.beginInsertRows(QtCore.QModelIndex(), first, first + len(items) - 1)
+		Playlist.extend(items)
+		self.endInsertRows()
+		
+		self.totals_changed()
+	
+	def change(self, length, songs=[]):
+		"""
+		Apply a playlist diff with row level notifications,
+		so selection and scroll position survive.
+		"""
+		old = len(Playlist.get())
+		
+		if length < old:
+			self.beginRemoveRows(QtCore.QModelIndex(), length, old - 1)
+		elif length > old:
+			self.beginInsertRows(QtCore.QModelIndex(), old, length - 1)
+		
+		Playlist.change(length, songs)
+		
+		if length < old:
+			self.endRemoveRows()
+		elif length > old:
+			self.endInsertRows()
+		
+		rows = [song.pos for song in songs if song.pos < min(old, length)]
+		
+		if rows:
+			self.dataChanged.emit(
+				self.index(min(rows), 0),
+				self.index(max(rows), 1)
+			)
+		
+		self.totals_changed()
+	
+	def fill(self, window, songs):
+		"""
+		Show the fetched tags of a window of a windowed playlist.
+		"""
+		rows = Playlist.fill(window, songs)
+		
+		if rows:
+			self.dataChanged.emit(
+				self.index(min(rows), 0),
+				self.index(max(rows), 1)
+			)
+	
+	def remove(self, ranges):
+		"""
+		Remove rows, given as (start, end) ranges that don't overlap,
+		with row level notifications like change().
+		"""
+		ranges = sorted(ranges, reverse=True)
+		
+		if not ranges: return
+		
+		# Highest first, so the lower ranges stay valid
+		for start, end in ranges:
+			self.beginRemoveRows(QtCore.QModelIndex(), start, end - 1)
+			Playlist.remove(start, end)
+			self.endRemoveRows()
+		
+		Playlist.renumber(ranges[-1][0])
+		
+		self.totals_changed()
+	
+	def clear(self):
+		"""
+		Empty Playlist and the model.
+		"""
+		self.beginResetModel()
+		Playlist.add()
+		self.endResetModel()
+	
+	def reload(self, currentid=-1):
+		"""
+		Show Playlist again after it was swapped out,
+		e.g. when switching servers.
+		"""
+		self.beginResetModel()
+		self.currentid = currentid
+		self.endResetModel()
+	
+	def setcurrent(self, songid):
+		"""
+		Change the current song, only the rows
+		of the previous and new song are redrawn.
+		"""
+		prev = Playlist.row(self.currentid)
+		self.currentid = songid
+		
+		for row in (prev, Playlist.row(songid)):
+			if row is None: continue
+			
+			self.dataChanged.emit(
+				self.index(row, 0),
+				self.index(row, 1),
+				[self.CurrentRole, QtCore.Qt.FontRole]
+			)
+		
+		# The time left starts after the current song
+		self.totals_changed()
+	
+	def __init__(self, parent=None):
+		super(PlaylistModel, self).__init__(parent)
+		
+		# Songid of the current song
+		self.currentid = -1
+		
+		self.boldfont = QtGui.QFont()
+		self.boldfont.setBold(True)
+
+class AlbumModel(QtCore.QAbstractListModel):
+	"""
+	List model for the album cover grid.
+	
+	Covers are only asked for by the delegate, so only visible
+	albums are looked up and loaded. Album directories are
+	looked up in batches by resolve(), through one of their songs.
+	"""
+	# Emitted when albums need to be looked up
+	unresolved = QtCore.pyqtSignal()
+	
+	def rowCount(self, parent=QtCore.QModelIndex()):
+		if parent.isValid(): return 0
+		
+		return len(self.albums)
+	
+	def data(self, index, role=QtCore.Qt.DisplayRole):
+		if not index.isValid(): return None
+		
+		item = self.albums[index.row()]
+		
+		if role == QtCore.Qt.DisplayRole:
+			return item.album
+		
+		elif role == QtCore.Qt.ToolTipRole:
+			return "{0}\n{1}".format(item.album, item.artist)
+		
+		elif role == QtCore.Qt.UserRole:
+			return ("albumartist", item.artist, "album", item.album)
+	
+	def cover(self, row):
+		"""
+		The cover of an album as a pixmap, None while it's loading.
+		"""
+		item = self.albums[row]
+		
+		if item.file is None:
+			if not self.waiting:
+				self.unresolved.emit()
+			
+			self.waiting.add(row)
+			return None
+		
+		# Nothing found
+		if not item.file: return None
+		
+		key = (coverpath(item.file), self.size)
+		pixmap = CoverLoader.get(*key)
+		
+		if pixmap is None:
+			self.requested.setdefault(key, set()).add(row)
+		
+		return pixmap
+	
+	def resolve(self, visible):
+		"""
+		Look up a song of each waiting album still
+		in view, one find per album in a single command list.
+		"""
+		rows = [row for row in self.waiting if visible(row)]
+		self.waiting = set()
+		
+		if not rows or not Player.connected: return
+		
+		Player.command_list_ok_begin()
+		
+		for row in rows:
+			item = self.albums[row]
+			Player.find(
+				"albumartist", item.artist,
+				"album", item.album,
+				"window", (0, 1)
+			)
+		
+		# MPD before 0.20 has no window, odd tags can fail too,
+		# those albums go without a cover.
+		try: founds = Player.command_list_end()
+		except CommandError: founds = [[]] * len(rows)
+		
+		for row, found in zip(rows, founds):
+			self.albums[row].file = found[0]["file"] if found else ""
+			self.dataChanged.emit(self.index(row), self.index(row))
+	
+	def cancel(self, visible):
+		"""
+		Stop loading covers of albums that were scrolled away.
+		"""
+		gone = [
+			key for key, rows in self.requested.items()
+			if key in CoverLoader.pending and not any(visible(row) for row in rows)
+		]
+		
+		CoverLoader.cancel(gone)
+		
+		for key in gone:
+			del self.requested[key]
+	
+	def cover_loaded(self, key):
+		for row in self.requested.pop(key, ()):
+			self.dataChanged.emit(self.index(row), self.index(row))
+	
+	def reset(self, albums=[]):
+		self.beginResetModel()
+		self.albums = albums
+		self.waiting = set()
+		self.requested = {}
+		self.endResetModel()
+	
+	def __init__(self, size, parent=None):
+		super(AlbumModel, self).__init__(parent)
+		
+		self.albums = []
+		
+		# Cover size in pixels
+		self.size = size
+		
+		# Rows waiting to be looked up
+		self.waiting = set()
+		
+		# Cover key -> rows, for covers still loading
+		self.requested = {}
+		
+		CoverLoader.loaded.connect(self.cover_loaded)
+
+class AlbumDelegate(QtWidgets.QStyledItemDelegate):
+	"""
+	Draws an album as its cover with the album and artist below.
+	Kept cheap, only cached pixmaps are ever drawn.
+	"""
+	def sizeHint(self, option, index):
+		return self.cell
+	
+	def paint(self, painter, option, index):
+		model = index.model()
+		item = model.albums[index.row()]
+		rect = option.rect
+		
+		if option.state & QtWidgets.QStyle.State_Selected:
+			painter.fillRect(rect, option.palette.highlight())
+			painter.setPen(option.palette.color(QtGui.QPalette.HighlightedText))
+		else:
+			painter.setPen(option.palette.color(QtGui.QPalette.Text))
+		
+		pixmap = model.cover(index.row())
+		
+		if pixmap is None or pixmap.isNull():
+			pixmap = self.nocover
+		
+		size = model.size
+		painter.drawPixmap(
+			rect.x() + (rect.width() - pixmap.width()) // 2,
+			rect.y() + 4 + (size - pixmap.height()) // 2,
+			pixmap
+		)
+		
+		metrics = option.fontMetrics
+		top = rect.y() + size + 8
+		
+		for text in (item.album, item.artist):
+			painter.drawText(
+				rect.x() + 4, top, rect.width() - 8, metrics.height(),
+				QtCore.Qt.AlignHCenter,
+				metrics.elidedText(text, QtCore.Qt.ElideRight, rect.width() - 8)
+			)
+			top += metrics.height()
+	
+	def __init__(self, size, fontheight, parent=None):
+		super(AlbumDelegate, self).__init__(parent)
+		
+		self.cell = QtCore.QSize(size + 16, size + 12 + fontheight * 2)
+		
+		self.nocover = QtGui.QPixmap("artwork/nocover.png").scaled(
+			size, size,
+			QtCore.Qt.KeepAspectRatio,
+			QtCore.Qt.SmoothTransformation
+		)
+
+class MainWindow(QtWidgets.QMainWindow):
+	# Emitted by ConnectJob for the server switched to
+	opened = QtCore.pyqtSignal(object, bool)
+	
+	# Polling intervals in ms, see reschedule(). Without and with
+	# an idle connection, which pushes everything but the clock.
+	# Polls also keep the command connection alive, MPD closes
+	# it after connection_timeout (60 s by default).
+	pollrates = {
+		"input": (250, 250),
+		"play": (500, 500),
+		"pause": (5000, 30000),
+		"hidden": (15000, 30000)
+	}
+	
+	def toggle_visibility(self):
+		"""
+		Hide/show main window.
+		"""
+		if self.isHidden():
+			self.show()
+		else:
+			if not app.activeWindow(): self.activateWindow()
+			else: self.hide()
+	
+	def closeEvent(self, event):
+		"""
+		Gets called when the window is closing.
+		Save size and position.
+		"""
+		
+		Settings.winsize = self.size()
+		Settings.winpos  = self.pos()
+		
+		self.timer.stop()
+		self.cancel_populate()
+		
+		event.accept()
+	
+	def connect_mpd(self):
+		"""
+		Connect to MPD server(s).
+		"""
+		for server in self.servers:
+			server.watcher.stop()
+		
+		self.servers = [Server(host, port) for host, port in Settings.servers]
+		
+		self.serverbox.blockSignals(True)
+		self.serverbox.clear()
+		
+		for num, server in enumerate(self.servers):
+			self.serverbox.addItem(server.name())
+			
+			server.watcher.changed.connect(
+				lambda changed, num=num: self.server_changed_state(num, changed)
+			)
+			server.watcher.lost.connect(
+				lambda num=num: self.server_changed_state(num, [])
+			)
+			
+			# Offline until the watcher connected, unreachable
+			# servers just stay that way.
+			self.server_changed_state(num, [])
+			server.watcher.start(server.host, server.port)
+		
+		self.serverbox.setCurrentIndex(0)
+		self.serverbox.setVisible(len(self.servers) > 1)
+		self.serverbox.blockSignals(False)
+		
+		self.switch_server(0)
+	
+	def switch_server(self, num):
+		"""
+		Make another server the active one. Its playlist and
+		library are shown from its cache straight away, the
+		connection is opened in the background.
+		"""
+		global Player, Playlist, Library, StoredPlaylists, TagCache
+		
+		self.cancel_populate()
+		self.timer.stop()
+		
+		# Idle connections don't time out, but an unpolled
+		# command connection would, so only the active one stays.
+		if Player.connected:
+			try: Player.disconnect()
+			except Exception: pass
+		
+		server = self.servers[num]
+		self.server = server
+		
+		Player = server.player
+		Playlist = server.playlist
+		Library = server.library
+		StoredPlaylists = server.storedlists
+		TagCache = server.tagcache
+		
+		self.playlist.reload(Player.lastsongid)
+		self.show_storedlists()
+		self.taglist.clear()
+		self.albums.reset()
+		
+		if Library.get():
+			self.show_library()
+		else:
+			self.liblist.clear()
+		
+		self.show_updating()
+		
+		# Still connecting from an earlier switch, server_opened() follows
+		if server.connecting: return
+		
+		server.connecting = True
+		ConnectJob.pool.start(ConnectJob(
+			Player, server.host, server.port, self.opened, server
+		))
+	
+	def server_opened(self, server, opened):
+		"""
+		Start showing a server once its connection is open,
+		unless another one was switched to meanwhile.
+		"""
+		server.connecting = False
+		
+		if server is not self.server:
+			try: server.player.disconnect()
+			except Exception: pass
+			return
+		
+		if not opened:
+			QtWidgets.QMessageBox.warning(self,
+				"Not connected",
+				"Can't connect to {0}".format(server.name())
+			)
+			self.show_disconnected()
+			return
+		
+		self.show_server()
+	
+	@require_connected
+	def show_server(self):
+		"""
+		Fill in what the cache of the active server
+		doesn't have and start polling it.
+		"""
+		if not Playlist.lastversion:
+			Playlist.reset()
+			Library.reset()
+			StoredPlaylists.reset()
+			TagCache.reset()
+			Player.reset()
+			
+			self.playlist.reload()
+			self.show_storedlists()
+		
+		if self.libstack.currentWidget() is self.tagview:
+			self.populate_tags()
+		elif self.libstack.currentWidget() is self.albumview:
+			self.populate_albums()
+		
+		if not Library.get():
+			self.populate_library(Library.lastroot)
+		
+		# Show this server's current song again
+		Player.lastsongid = -1
+		self.nextlabels = (-1, None)
+		Bus.reset()
+		self.update()
+		
+		self.timer.start(self.pollrates["play"][0])
+		self.reschedule()
+	
+	def server_changed_state(self, num, changed):
+		"""
+		Run when the idle connection of a server reports changes.
+		"""
+		server = self.servers[num]
+		status = server.watcher.status if server.watcher.notifier else {}
+		
+		icons = {
+			"play": self.starticon,
+			"pause": self.pausedicon,
+			"stop": self.stopicon
+		}
+		
+		self.serverbox.setItemIcon(num,
+			icons.get(status.get("state"), self.offlineicon)
+		)
+		
+		if "update" in changed or "database" in changed:
+			running = server.watcher.status.get("updating_db")
+			self.finish_updates(server, running and int(running), changed)
+		
+		# Push updates make the active server respond right away,
+		# the watcher fetched status already.
+		if changed and server.player is Player and Player.connected:
+			Bus.publish(status, changed)
+	
+	@require_connected
+	def database_changed(self):
+		"""
+		Reload the views built from the database.
+		"""
+		if self.taglist.rowCount():
+			self.populate_tags()
+		
+		if self.albums.rowCount():
+			self.populate_albums()
+	
+	@require_connected
+	def storedlists_changed(self):
+		if StoredPlaylists.get():
+			self.populate_storedlists()
+	
+	def disconnect_mpd(self):
+		"""
+		Disconnect from MPD server(s).
+		"""
+		try: Player.disconnect()
+		except Exception as e:
+			# Just show a warning
+			QtWidgets.QMessageBox.warning(self,
+				str(e),
+				str(e)
+			)
+		
+		for server in self.servers:
+			server.watcher.stop()
+			self.serverbox.setItemIcon(self.servers.index(server), self.offlineicon)
+		
+		# A connection still being opened is dropped once it is
+		self.server = None
+		
+		self.show_disconnected()
+	
+	def show_disconnected(self):
+		"""
+		Reset the GUI to its disconnected state.
+		"""
+		self.timer.stop()
+		self.cancel_populate()
+		Bus.reset()
+		
+		Playlist.reset()
+		self.playlist.reload()
+		self.liblist.clear()
+		self.storedlists.clear()
+		self.taglist.clear()
+		self.albums.reset()
+		self.updatebar.hide()
+		
+		self.coverkey = None
+		self.nextlabels = (-1, None)
+		self.render(self.albumcover, "setPixmap", self.nocover)
+		self.render(self.songtitle, "setText", "Disconnected")
+		self.render(self.songwriter, "setText", "")
+		self.render(self.songlength, "setText", "")
+		
+		self.render(self.playbutton, "setIcon", self.starticon)
+		
+		self.songslider.setValue(0)
+	
+	@require_connected
+	def prevsong(self, *args):
+		"""
+		Go to previous song in playlist.
+		"""
+		Player.previous()
+	
+	@require_connected
+	def playsong(self, *args):
+		"""
+		Play or pause current song.
+		"""
+		if Player.laststate == "play":
+			Player.pause()
+		else:
+			Player.play()
+	
+	@require_connected
+	def stopsong(self, *args):
+		"""
+		Stop playing current song.
+		"""
+		Player.stop()
+	
+	@require_connected
+	def nextsong(self, *args):
+		"""
+		Skip to next song in playlist.
+		"""
+		Player.next()
+	
+	def showsearch(self):
+		"""
+		Show/Hide the search box.
+		"""
+		if self.searchbox.isHidden():
+			self.searchbox.clear()
+			self.searchbox.show()
+			self.searchbox.setFocus()
+		else:
+			self.searchbox.hide()
+			self.playlistview.setFocus()
+	
+	def searchsong(self):
+		"""
+		Search for song from playlist and set focus to it.
+		"""
+		# Returns a list but we only want one item
+		i = self.playlist.match(
+			self.playlist.index(0,0),
+			QtCore.Qt.DisplayRole,
+			self.searchbox.text(), # value
+			1, # number of items
+			QtCore.Qt.MatchContains
+		)
+		# No match, do nothing
+		if not i: return
+		
+		self.playlistview.scrollTo(
+			i[0],
+			QtWidgets.QAbstractItemView.PositionAtCenter
+		)
+		self.playlistview.setCurrentIndex(i[0])
+		
+		self.showsearch()
+	
+	def jumptosong(self):
+		"""
+		Jump to currently playing song in playlist.
+		"""
+		row = Playlist.row(Player.lastsongid)
+		
+		if row is None: return
+		
+		self.playlistview.scrollTo(
+			self.playlist.index(row, 0),
+			QtWidgets.QAbstractItemView.PositionAtCenter
+		)
+		
+		self.playlistview.setCurrentIndex(
+			self.playlist.index(row, 0)
+		)
+		
+	@require_connected
+	def addplaylist(self, *args):
+		"""
+		Add current library selection to
+		playlist.
+		"""
+		Player.command_list_ok_begin()
+		
+		for entry in self.selected_library():
+			if entry.get("directory"):
+				# Special entries "/" and ".." aren't added
+				if entry["directory"] != "..":
+					Player.add(entry["directory"])
+			
+			elif entry.get("file"):
+				Player.add(entry["file"])
+		
+		Player.command_list_end()
+	
+	def selected_library(self):
+		"""
+		Library entries of all selected rows,
+		the current row if nothing is selected.
+		"""
+		rows = [index.row() for index in self.libview.selectionModel().selectedRows()]
+		
+		if not rows:
+			rows = [self.libview.currentIndex().row()]
+		
+		return [Library.get(row) for row in sorted(rows) if row >= 0]
+	
+	@require_connected
+	def findadd(self, album=False):
+		"""
+		Add every song by the artists (or on the albums) of the
+		selected library songs. Songs are searched and added on
+		the server, the client never sees the list.
+		"""
+		filters = []
+		
+		for entry in self.selected_library():
+			if not entry.get("file"): continue
+			
+			# Album artist keeps compilations together
+			if entry.get("albumartist"):
+				filt = tagfilter("albumartist", entry["albumartist"])
+			elif entry.get("artist"):
+				filt = tagfilter("artist", entry["artist"])
+			else:
+				filt = ()
+			
+			if album:
+				if not entry.get("album"): continue
+				
+				filt += tagfilter("album", entry["album"])
+			
+			if filt and filt not in filters:
+				filters.append(filt)
+		
+		self.addfilters(filters)
+	
+	@require_connected
+	def addfilters(self, filters, replace=False):
+		"""
+		Run findadd for every tag filter, single songs
+		are given as ("file", uri) and just added.
+		"""
+		if not filters: return
+		
+		# MPD filters can't do OR, one findadd per selection
+		# in a single command list.
+		Player.command_list_ok_begin()
+		
+		if replace:
+			Player.clear()
+		
+		for filt in filters:
+			if filt[0] == "file":
+				Player.add(filt[1])
+			else:
+				Player.findadd(*filt)
+		
+		Player.command_list_end()
+	
+	@require_connected
+	def searchadd(self):
+		"""
+		Add every song with any tag containing the entered text,
+		searched and added on the server.
+		"""
+		text, ok = QtWidgets.QInputDialog.getText(self,
+			"Add matching",
+			"Add songs matching:"
+		)
+		
+		if ok and text:
+			Player.searchadd("any", text)
+	
+	@require_connected
+	def replaceplaylist(self):
+		"""
+		Replace current playlist with library selection.
+		"""
+		Player.clear()
+		self.addplaylist()
+	
+	def selected_path(self):
+		"""
+		Path of the current library selection,
+		for directories and songs alike.
+		"""
+		sel = Library.get(self.libview.currentIndex().row())
+		
+		if sel.get("directory") == "..":
+			return Library.lastroot.rpartition("/")[0]
+		
+		if sel.get("directory") != None:
+			return sel["directory"]
+		
+		return sel["file"]
+	
+	@require_connected
+	def updatelibrary(self):
+		"""
+		Update current library selection in MPD database.
+		"""
+		path = self.selected_path()
+		
+		Library.jobs[int(Player.update(path))] = path
+		self.show_updating()
+	
+	@require_connected
+	def rescanlibrary(self):
+		"""
+		Rescan current library selection into the
+		MPD database.
+		"""
+		path = self.selected_path()
+		
+		Library.jobs[int(Player.rescan(path))] = path
+		self.show_updating()
+	
+	def updating_changed(self, running):
+		"""
+		Update jobs are also seen finishing in polled status,
+		for servers without a working idle connection.
+		"""
+		if self.server is not None:
+			self.finish_updates(self.server, running, ())
+	
+	def finish_updates(self, server, running, changed):
+		"""
+		Drop the cached listings under the paths of update
+		jobs that finished, and show the current one again
+		if it was among them. running is the job id MPD
+		is working on, 0 or None if none.
+		"""
+		library = server.library
+		
+		# Jobs run in order, everything before the running one is done
+		done = [
+			job for job in library.jobs
+			if not running or job < running
+		]
+		
+		for job in done:
+			library.invalidate(library.jobs.pop(job))
+		
+		# Updated by another client, no telling where
+		if "database" in changed and not done and not library.jobs:
+			library.invalidate("")
+		
+		if server.library is not Library: return
+		
+		self.show_updating()
+		
+		if Library.lastroot not in Library.listings and Library.get() and \
+		Player.connected:
+			self.refresh_library()
+	
+	@require_connected
+	def refresh_library(self):
+		self.populate_library(Library.lastroot)
+	
+	def show_updating(self):
+		"""
+		Show the progress indicator while update jobs are running.
+		"""
+		if Library.jobs:
+			self.updatebar.setFormat("Updating {0}".format(
+				", ".join(sorted(path or "/" for path in Library.jobs.values()))
+			))
+			self.updatebar.show()
+		else:
+			self.updatebar.hide()
+	
+	@require_connected
+	def clearplaylist(self):
+		"""
+		Simply clears the current playlist.
+		"""
+		Player.clear()
+	
+	def selected_rows(self):
+		"""
+		Rows selected in the playlist, in order.
+		"""
+		return sorted(
+			index.row() for index in self.playlistview.selectionModel().selectedRows()
+		)
+	
+	def select_songs(self, songs):
+		"""
+		Select the rows of songs in the playlist,
+		e.g. to keep the selection on songs that moved.
+		"""
+		selection = QtCore.QItemSelection()
+		
+		for song in songs:
+			row = Playlist.row(song.id)
+			
+			if row is None: continue
+			
+			selection.select(self.playlist.index(row, 0), self.playlist.index(row, 1))
+		
+		self.playlistview.selectionModel().select(
+			selection,
+			QtCore.QItemSelectionModel.ClearAndSelect
+		)
+		
+		if songs:
+			self.playlistview.scrollTo(self.playlist.index(Playlist.row(songs[0].id), 0))
+	
+	def moverows(self, rows, target):
+		"""
+		Move the songs in rows to before row target,
+		keeping their order. Dragged rows end up here.
+		"""
+		songs = Playlist.get()
+		rows = set(rows)
+		
+		moving = [songs[row] for row in sorted(rows)]
+		rest = [song for row, song in enumerate(songs) if row not in rows]
+		
+		# Target counted without the moving rows
+		at = target - len([row for row in rows if row < target])
+		
+		self.reorder(rest[:at] + moving + rest[at:])
+		self.select_songs(moving)
+	
+	def moveselection(self, step):
+		"""
+		Move the selected songs one row up (step -1) or down (1),
+		songs at the top or bottom stay and so do the ones behind them.
+		"""
+		rows = self.selected_rows()
+		
+		if not rows: return
+		
+		order = list(Playlist.get())
+		moving = [order[row] for row in rows]
+		stuck = set()
+		
+		# Leading songs first, so blocks move as a whole
+		for row in (rows if step < 0 else rows[::-1]):
+			to = row + step
+			
+			if not 0 <= to < len(order) or to in stuck:
+				stuck.add(row)
+				continue
+			
+			order[row], order[to] = order[to], order[row]
+		
+		self.reorder(order)
+		self.select_songs(moving)
+	
+	@require_connected
+	def removeselection(self):
+		"""
+		Remove the selected songs from the playlist. Runs of rows
+		are deleted as ranges, in one command list.
+		"""
+		if self.loader: return
+		
+		ranges = []
+		
+		for row in self.selected_rows():
+			if ranges and ranges[-1][1] == row:
+				ranges[-1][1] = row + 1
+			else:
+				ranges.append([row, row + 1])
+		
+		if not ranges: return
+		
+		ranges = [tuple(span) for span in reversed(ranges)]
+		
+		self.playlist.remove(ranges)
+		
+		def send():
+			for span in ranges:
+				Player.delete(span)
+		
+		self.apply_playlist(send, len(Playlist.get()))
+	
+	def apply_playlist(self, send, length):
+		"""
+		Run the playlist commands send() issues in one command list.
+		
+		The model was changed already, the list is atomic on MPD, so
+		the version before and after it tell whether anything else
+		changed meanwhile. The version that results is taken as
+		already applied, status reporting it reloads nothing.
+		"""
+		Player.command_list_ok_begin()
+		Player.status()
+		
+		send()
+		
+		Player.status()
+		
+		try: results = Player.command_list_end()
+		except CommandError:
+			# Some of the commands may have been run
+			self.populate_playlist(length)
+			return
+		
+		before, after = results[0], results[-1]
+		
+		if before["playlist"] != Playlist.lastversion:
+			self.populate_playlist(int(after["playlistlength"]))
+		
+		Playlist.lastversion = after["playlist"]
+	
+	def sortplaylist(self):
+		"""
+		Sort the playlist by album, disc and track.
+		"""
+		if self.loader or Playlist.windowed: return
+		
+		self.reorder(sorted(
+			Playlist.get(),
+			key=lambda song: (albumkey(song), song.disc, song.track, song.file)
+		))
+	
+	def shufflealbums(self):
+		"""
+		Shuffle the playlist by album, the songs of
+		an album stay together in disc and track order.
+		"""
+		if self.loader or Playlist.windowed: return
+		
+		albums = {}
+		
+		for song in Playlist.get():
+			albums.setdefault(albumkey(song), []).append(song)
+		
+		albums = list(albums.values())
+		random.shuffle(albums)
+		
+		self.reorder([
+			song
+			for album in albums
+			for song in sorted(album, key=lambda song: (song.disc, song.track))
+		])
+	
+	@require_connected
+	def reorder(self, order):
+		"""
+		Rearrange the playlist into order, a list of its songs.
+		The model is changed right away, MPD gets the moves in
+		one command list.
+		"""
+		# Rows aren't final while the playlist is streaming
+		if self.loader: return
+		
+		moves = moveplan(
+			[song.id for song in Playlist.get()],
+			[song.id for song in order]
+		)
+		
+		if not moves: return
+		
+		# A block of songs that moves as a whole is one range move,
+		# only if they are adjacent before and after, in the same order.
+		moved = sorted(moves, key=lambda move: Playlist.row(move[0]))
+		rows = [Playlist.row(songid) for songid, pos in moved]
+		ids = [songid for songid, pos in moved]
+		first = [song.id for song in order].index(ids[0])
+		
+		block = len(moves) > 1 and \
+			rows == list(range(rows[0], rows[0] + len(rows))) and \
+			[song.id for song in order[first:first + len(ids)]] == ids
+		
+		changed = []
+		
+		for pos, song in enumerate(order):
+			if song.pos != pos:
+				song.pos = pos
+				changed.append(song)
+		
+		self.playlist.change(len(order), changed)
+		
+		def send():
+			if block:
+				Player.move((rows[0], rows[-1] + 1), first)
+			else:
+				for songid, pos in moves:
+					Player.moveid(songid, pos)
+		
+		self.apply_playlist(send, len(order))
+	
+	def populate_playlist(self, length=0):
+		"""
+		Start streaming the playlist into the playlist model.
+		
+		The reply is read in iterate mode on a separate connection
+		so the timer keeps polling status meanwhile, rows are added
+		in chunks between event loop iterations by populate_chunk().
+		"""
+		self.cancel_populate()
+		
+		self.loader = PlayerObj()
+		self.loader.connect(Player.host, Player.port)
+		self.loader.iterate = True
+		
+		# Huge playlists only get their songids,
+		# fetch_visible() adds the tags in view.
+		windowed = length >= self.windowfrom
+		
+		if windowed:
+			self.loaderitems = self.loader.plchangesposid(0)
+		else:
+			self.loaderitems = self.loader.playlistinfo()
+		
+		self.playlist.clear()
+		Playlist.windowed = windowed
+		
+		# All rows at once, every insert makes the view lay out
+		# all rows again. Stubs are put in by populate_chunk().
+		if windowed:
+			self.playlist.change(length)
+		
+		self.loadbar.setRange(0, length)
+		self.loadbar.setValue(0)
+		self.loadbar.show()
+		
+		# Show the first screen of rows right away
+		self.populate_chunk()
+	
+	@require_connected
+	def populate_chunk(self):
 		"""
-		Hide/show main window.
+		Adds the next chunk of streamed entries into the playlist model.
 		"""
-		if self.isHidden():
-			self.show()
+		if not self.loader: return # Cancelled
+		
+		if Playlist.windowed:
+			# Stubs are cheap, take more at once
+			size = self.chunksize * 20
+			count = Playlist.place(islice(self.loaderitems, size))
+			
+			self.loadbar.setValue(len(Playlist.ids))
+			self.windowtimer.start()
 		else:
-			if not app.activeWindow(): self.activateWindow()
-			else: self.hide()
+			size = self.chunksize
+			first = len(Playlist.get())
+			
+			self.playlist.extend(islice(self.loaderitems, size))
+			count = len(Playlist.get()) - first
+			
+			self.loadbar.setValue(len(Playlist.get()))
+		
+		if count < size:
+			# Reply fully read
+			self.cancel_populate()
+			
+			# Songs that changed while streaming can be shown now
+			if Player.lastsongid != int(Bus.status.get("songid", "-1")):
+				self.song_changed()
+			
+			self.prefetch(int(Bus.status.get("nextsongid", "-1")))
+		else:
+			QtCore.QTimer.singleShot(0, self.populate_chunk)
 	
-	def closeEvent(self, event):
+	def fetch_visible(self):
 		"""
-		Gets called when the window is closing.
-		Save size and position.
+		Fetch the tags of the rows in view of a windowed
+		playlist, and of a window before and after them.
 		"""
+		if Playlist.windowed and Player.connected:
+			self.fetch_nearby()
+	
+	@require_connected
+	def fetch_nearby(self):
+		rows = len(Playlist.get())
 		
-		Settings.winsize = self.size()
-		Settings.winpos  = self.pos()
+		if not rows: return
 		
-		self.timer.stop()
+		view = self.playlistview
+		first = view.indexAt(QtCore.QPoint(0, 0)).row()
+		last = view.indexAt(QtCore.QPoint(0, view.viewport().height() - 1)).row()
 		
-		event.accept()
+		if first < 0: first = 0
+		if last < 0: last = rows - 1
+		
+		size = Playlist.windowsize
+		
+		self.fetch_windows(range(
+			max(first - size, 0) // size,
+			min(last + size, rows - 1) // size + 1
+		))
 	
-	def connect_mpd(self):
+	def fetch_windows(self, windows):
 		"""
-		Connect to MPD server.
+		Fetch the windows that still have stubs, in one command list.
 		"""
-		try: Player.connect(Settings.server, Settings.port)
-		except Exception as e:
-			# Just show a warning
-			QtWidgets.QMessageBox.warning(self,
-				str(e),
-				str(e)
-			)
-			return
+		size = Playlist.windowsize
+		rows = len(Playlist.get())
+		missing = []
 		
-		Playlist.reset()
-		Library.reset()
-		Player.reset()
+		for window in windows:
+			if Playlist.stubbed(window * size, (window + 1) * size):
+				missing.append(window)
+			else:
+				Playlist.touch(window)
+		
+		if not missing: return
+		
+		Player.command_list_ok_begin()
+		
+		for window in missing:
+			Player.playlistinfo((window * size, min((window + 1) * size, rows)))
 		
-		self.populate_library()
+		# Changed meanwhile, the update that follows fetches again
+		try: found = Player.command_list_end()
+		except CommandError: return
 		
-		self.timer.start(500)
+		for window, items in zip(missing, found):
+			self.playlist.fill(window, [Song(item) for item in items])
 	
-	def disconnect_mpd(self):
+	def complete(self, row):
 		"""
-		Disconnect from MPD server.
+		The song at row with its tags, fetched
+		first if the playlist is windowed.
 		"""
-		try: Player.disconnect()
-		except Exception as e:
-			# Just show a warning
-			QtWidgets.QMessageBox.warning(self,
-				str(e),
-				str(e)
-			)
+		if Playlist.stubbed(row, row + 1):
+			self.fetch_windows([row // Playlist.windowsize])
 		
-		self.timer.stop()
+		return Playlist.get(row)
+	
+	def cancel_populate(self):
+		"""
+		Stop streaming the playlist, e.g. when a newer
+		playlist version arrives before it's done.
+		"""
+		if not self.loader: return
 		
-		self.playlist.clear()
-		self.liblist.clear()
+		try:
+			self.loaderitems.close()
+			self.loader.disconnect()
+		except Exception: pass # Connection is thrown away anyway
+		
+		self.loader = None
+		self.loaderitems = None
+		
+		self.loadbar.hide()
+	
+	def populate_library(self, root=""):
+		"""
+		Adds entries into the library model.
+		"""
+		if not Library.load(root):
+			Library.add(Player.lsinfo(root), root)
 		
-		self.albumcover.setPixmap(self.nocover)
-		self.songtitle.setText("Disconnected")
-		self.songwriter.setText("")
-		self.songlength.setText("")
+		Library.lastroot = root # Save root so ".." works
 		
-		self.playbutton.setIcon(self.starticon)
+		self.show_library()
+	
+	def show_library(self):
+		"""
+		Fill the library model from the current Library listing.
+		"""
+		self.liblist.clear()
 		
-		self.songslider.setValue(0)
+		# Add dirs and files with different icons.
+		# Dirs will be listed first because the listing
+		# is sorted during .add().
+		# Dir listing will also always have special items "/" and "..".
+		for item in Library.get():
+			# Directory
+			if item.get("directory") != None:
+				if item.get("directory") == "":
+					name = "/"
+				elif item.get("directory") == "..":
+					name = ".."
+				else:
+					name = item["directory"].split("/")[-1]
+				
+				row = QtGui.QStandardItem(
+					QtGui.QIcon("artwork/inode-directory.png"),
+					name
+				)
+			# File
+			else:
+				row = QtGui.QStandardItem(
+					QtGui.QIcon("artwork/audio-x-generic.png"),
+					item["file"].split("/")[-1]
+				)
+			
+			row.setEditable(False)
+			
+			self.liblist.appendRow(row)
 	
 	@require_connected
-	def prevsong(self, *args):
+	def populate_storedlists(self):
 		"""
-		Go to previous song in playlist.
+		Fetch the list of stored playlists.
 		"""
-		Player.previous()
+		StoredPlaylists.add(Player.listplaylists())
+		
+		self.show_storedlists()
+	
+	def show_storedlists(self):
+		"""
+		Fill the stored playlists model. Playlists get a
+		placeholder child, their songs are loaded on expansion.
+		"""
+		self.storedlists.clear()
+		
+		for name, modified in StoredPlaylists.get():
+			row = QtGui.QStandardItem(
+				QtGui.QIcon("artwork/media-playlist-repeat.png"),
+				name
+			)
+			row.setEditable(False)
+			row.setData(name, QtCore.Qt.UserRole)
+			
+			loading = QtGui.QStandardItem("Loading...")
+			loading.setEditable(False)
+			row.appendRow(loading)
+			
+			self.storedlists.appendRow(row)
+	
+	def storedtab_shown(self, num):
+		"""
+		Stored playlists are only fetched when their tab is first shown.
+		"""
+		if self.tabs.widget(num) is self.storedview and \
+		Player.connected and not StoredPlaylists.get():
+			self.populate_storedlists()
 	
 	@require_connected
-	def playsong(self, *args):
+	def storedlist_expanded(self, index):
 		"""
-		Play or pause current song.
+		Load the songs of a stored playlist when it's expanded,
+		from the cache if it hasn't been modified.
 		"""
-		if Player.laststate == "play":
-			Player.pause()
-		else:
-			Player.play()
+		row = self.storedlists.itemFromIndex(index)
+		
+		# Already loaded
+		if row.parent() or row.child(0).data(QtCore.Qt.UserRole) is not None:
+			return
+		
+		name, modified = StoredPlaylists.get(index.row())
+		
+		songs = StoredPlaylists.songs(name, modified)
+		
+		if songs is None:
+			songs = StoredPlaylists.store(
+				name,
+				modified,
+				Player.listplaylistinfo(name)
+			)
+		
+		row.removeRows(0, row.rowCount())
+		
+		for pos, song in enumerate(songs):
+			child = QtGui.QStandardItem(songtext(song))
+			child.setEditable(False)
+			child.setData(pos, QtCore.Qt.UserRole)
+			
+			row.appendRow(child)
 	
 	@require_connected
-	def stopsong(self, *args):
+	def loadstored(self, *args, replace=False):
 		"""
-		Stop playing current song.
+		Load the selected stored playlists into the playlist. Selected
+		songs are loaded as ranges, one per run of adjacent songs,
+		MPD adds them server-side either way.
 		"""
-		Player.stop()
+		indexes = self.storedview.selectionModel().selectedRows()
+		
+		if not indexes:
+			indexes = [self.storedview.currentIndex()]
+		
+		indexes = [index for index in indexes if index.isValid()]
+		
+		if not indexes: return
+		
+		# Playlist name -> selected positions, None for all of it
+		selected = OrderedDict()
+		
+		for index in sorted(indexes, key=lambda index: (
+			(index.parent().row(), index.row()) if index.parent().isValid()
+			else (index.row(), -1)
+		)):
+			if not index.parent().isValid():
+				selected[index.data(QtCore.Qt.UserRole)] = None
+				continue
+			
+			name = index.parent().data(QtCore.Qt.UserRole)
+			pos = index.data(QtCore.Qt.UserRole)
+			
+			# "Loading..." placeholder, or the whole playlist is loaded
+			if pos is None or selected.get(name, []) is None: continue
+			
+			selected.setdefault(name, []).append(pos)
+		
+		loads = []
+		
+		for name, positions in selected.items():
+			if positions is None:
+				loads.append((name,))
+				continue
+			
+			start = positions[0]
+			
+			for prev, pos in zip(positions, positions[1:] + [None]):
+				if pos != prev + 1:
+					loads.append((name, (start, prev + 1)))
+					start = pos
+		
+		if not loads: return
+		
+		Player.command_list_ok_begin()
+		
+		if replace:
+			Player.clear()
+		
+		for load in loads:
+			Player.load(*load)
+		
+		Player.command_list_end()
+	
+	def storedlist_activated(self, index):
+		"""
+		Double clicking a playlist only expands it, double
+		clicking one of its songs loads the selected songs.
+		Enter loads the selection either way.
+		"""
+		if index.parent().isValid():
+			self.loadstored()
+	
+	def storedmenu(self, origin):
+		"""
+		The menu that is displayed when right clicking
+		on the stored playlists.
+		"""
+		menu = QtWidgets.QMenu()
+		
+		entries = (
+			("Load", "", "artwork/list-add.png", self.loadstored),
+			("Replace", "", "artwork/edit-redo.png", lambda: self.loadstored(replace=True)),
+			("separator", None, None, None),
+			("Refresh", "", "artwork/folder-sync.png", self.populate_storedlists)
+		)
+		
+		self.populatemenu(menu, entries)
+		
+		menu.exec_(self.storedview.mapToGlobal(origin))
+	
+	def libmode_changed(self, num):
+		"""
+		Switch the library tab between the folder
+		view, the tag browser and the album grid.
+		"""
+		if num == 0:
+			self.libstack.setCurrentWidget(self.libview)
+		elif num == 3:
+			self.libstack.setCurrentWidget(self.albumview)
+			
+			if Player.connected:
+				self.populate_albums()
+		else:
+			self.libstack.setCurrentWidget(self.tagview)
+			
+			if Player.connected:
+				self.populate_tags()
 	
 	@require_connected
-	def nextsong(self, *args):
+	def populate_tags(self):
 		"""
-		Skip to next song in playlist.
+		Fill the tag browser with its top level, artists or genres.
 		"""
-		Player.next()
+		TagCache.check(Player.stats().get("db_update"))
+		
+		self.taglist.clear()
+		
+		if self.libmode.currentIndex() == 1:
+			root = ("albumartist",)
+		else:
+			root = ("genre",)
+		
+		self.add_tagnodes(self.taglist.invisibleRootItem(), root)
 	
-	def showsearch(self):
+	def tagchildren(self, filt):
 		"""
-		Show/Hide the search box.
+		Children of a tag browser node as (text, filter) pairs,
+		fetched with grouped list queries and cached per node.
 		"""
-		if self.searchbox.isHidden():
-			self.searchbox.clear()
-			self.searchbox.show()
-			self.searchbox.setFocus()
+		children = TagCache.get(filt)
+		
+		if children is not None: return children
+		
+		# Artists, their albums come with the same query
+		if filt == ("albumartist",):
+			albums = grouped(
+				Player.list("album", "group", "albumartist"),
+				"albumartist",
+				"album"
+			)
+			
+			for artist in albums:
+				TagCache.store(("albumartist", artist), [
+					(album, ("albumartist", artist, "album", album))
+					for album in sorted(set(albums[artist]))
+				])
+			
+			children = [
+				(artist or "(No artist)", ("albumartist", artist))
+				for artist in sorted(albums)
+			]
+		
+		elif filt == ("genre",):
+			genres = [item.get("genre", "") for item in Player.list("genre")]
+			
+			children = [
+				(genre or "(No genre)", ("genre", genre))
+				for genre in sorted(genres)
+			]
+		
+		# Albums in a genre
+		elif filt[0] == "genre" and len(filt) == 2:
+			albums = grouped(
+				Player.list("album", "genre", filt[1], "group", "albumartist"),
+				"albumartist",
+				"album"
+			)
+			
+			children = sorted(
+				("{0} ({1})".format(album, artist or "No artist"),
+				filt + ("albumartist", artist, "album", album))
+				for artist in albums for album in set(albums[artist])
+			)
+		
+		# Tracks of one album, the only full song metadata fetched
 		else:
-			self.searchbox.hide()
-			self.playlistview.setFocus()
+			songs = sorted(
+				(Song(item) for item in Player.find(*filt)),
+				key=lambda song: (song.disc, song.track)
+			)
+			
+			children = [(songtext(song), ("file", song.file)) for song in songs]
+		
+		return TagCache.store(filt, children)
 	
-	def searchsong(self):
+	def add_tagnodes(self, parent, filt):
 		"""
-		Search for song from playlist and set focus to it.
+		Add the children of a node to the tag browser. Anything
+		but tracks gets a placeholder so it can be expanded.
 		"""
-		# Returns a list but we only want one item
-		i = self.playlist.match(
-			self.playlist.index(0,0),
-			QtCore.Qt.DisplayRole,
-			self.searchbox.text(), # value
-			1, # number of items
-			QtCore.Qt.MatchContains
-		)
-		# No match, do nothing
-		if not i: return
+		for text, childfilt in self.tagchildren(filt):
+			node = QtGui.QStandardItem(text)
+			node.setEditable(False)
+			node.setData(childfilt, QtCore.Qt.UserRole)
+			
+			if childfilt[0] == "file":
+				node.setIcon(QtGui.QIcon("artwork/audio-x-generic.png"))
+			else:
+				node.setIcon(QtGui.QIcon("artwork/inode-directory.png"))
+				
+				loading = QtGui.QStandardItem("Loading...")
+				loading.setEditable(False)
+				node.appendRow(loading)
+			
+			parent.appendRow(node)
+	
+	@require_connected
+	def tagnode_expanded(self, index):
+		"""
+		Load the children of a tag browser node on expansion.
+		"""
+		node = self.taglist.itemFromIndex(index)
 		
-		self.playlistview.scrollTo(
-			i[0],
-			QtWidgets.QAbstractItemView.PositionAtCenter
-		)
-		self.playlistview.setCurrentIndex(i[0])
+		# Already loaded
+		if node.child(0).data(QtCore.Qt.UserRole) is not None:
+			return
 		
-		self.showsearch()
+		node.removeRows(0, node.rowCount())
+		
+		self.add_tagnodes(node, node.data(QtCore.Qt.UserRole))
 	
-	def jumptosong(self):
+	def tagmenu(self, origin):
 		"""
-		Jump to currently playing song in playlist.
+		The menu that is displayed when right clicking
+		on the tag browser.
 		"""
-		self.playlistview.scrollTo(
-			self.playlist.index(Player.lastsong, 0),
-			QtWidgets.QAbstractItemView.PositionAtCenter
-		)
+		menu = QtWidgets.QMenu()
 		
-		self.playlistview.setCurrentIndex(
-			self.playlist.index(Player.lastsong, 0)
+		entries = (
+			("Add", "", "artwork/list-add.png", self.addtags),
+			("Replace", "", "artwork/edit-redo.png", lambda: self.addtags(replace=True)),
+			("separator", None, None, None),
+			("Refresh", "", "artwork/folder-sync.png", self.populate_tags)
 		)
 		
-	@require_connected
-	def addplaylist(self, *args):
-		"""
-		Add current library selection to
-		playlist.
-		"""
-		entry = Library.get(self.libview.currentIndex().row())
+		self.populatemenu(menu, entries)
 		
-		if entry.get("directory"):
-			Player.add(entry["directory"])
-				
-		else:
-			Player.add(entry["file"])
+		menu.exec_(self.tagview.mapToGlobal(origin))
 	
-	@require_connected
-	def replaceplaylist(self):
+	def addtags(self, *args, replace=False):
 		"""
-		Replace current playlist with library selection.
+		Add everything under the selected tag browser nodes,
+		matched and added on the server.
 		"""
-		Player.clear()
-		self.addplaylist()
-
+		filters = [
+			index.data(QtCore.Qt.UserRole)
+			for index in self.tagview.selectionModel().selectedRows()
+		]
+		
+		# "Loading..." placeholders have no filter
+		self.addfilters([filt for filt in filters if filt is not None], replace)
+	
 	@require_connected
-	def updatelibrary(self):
+	def populate_albums(self):
 		"""
-		Update current library selection in MPD database.
+		Fill the album grid, from the same cached
+		query as the tag browser's artists.
 		"""
-		sel = Library.get(self.libview.currentIndex().row())
-
-		Player.update(sel["directory"])
+		TagCache.check(Player.stats().get("db_update"))
+		
+		self.albums.reset([
+			Album(filt[1], album)
+			for text, filt in self.tagchildren(("albumartist",))
+			for album, albumfilt in TagCache.get(filt)
+		])
 	
-	@require_connected
-	def rescanlibrary(self):
+	def album_visible(self, row):
+		return self.albumview.visualRect(self.albums.index(row)).intersects(
+			self.albumview.viewport().rect()
+		)
+	
+	def albums_settled(self):
 		"""
-		Rescan current library selection into the
-		MPD database.
+		Scrolling stopped for a moment, look up what's in
+		view and stop loading what isn't.
 		"""
-		sel = Library.get(self.libview.currentIndex().row())
-
-		Player.rescan(sel["directory"])
+		self.albums.cancel(self.album_visible)
+		
+		if Player.connected:
+			self.resolve_albums()
 	
 	@require_connected
-	def clearplaylist(self):
-		"""
-		Simply clears the current playlist.
-		"""
-		Player.clear()
+	def resolve_albums(self):
+		self.albums.resolve(self.album_visible)
 	
-	def populate_playlist(self):
+	def albummenu(self, origin):
 		"""
-		Adds entries into the playlist model.
+		The menu that is displayed when right clicking
+		on the album grid.
 		"""
-		Playlist.add(Player.playlistinfo())
-		self.playlist.clear()
+		menu = QtWidgets.QMenu()
 		
-		for item in Playlist.get():
-			artist = item.get("artist", False)
-			title = item.get("title", False)
-			length = propertime(int(item["time"]))
-
-			if all([artist, title]):
-				song = "{0} - {1}".format(artist, title)
-			# Tags missing
-			else:
-				song = item["file"]
-			
-			col1 = QtGui.QStandardItem(song)
-			col2 = QtGui.QStandardItem(length)
-			
-			col1.setEditable(False)
-			col2.setEditable(False)
-			
-			self.playlist.appendRow([col1, col2])
+		entries = (
+			("Add", "", "artwork/list-add.png", self.addalbums),
+			("Replace", "", "artwork/edit-redo.png", lambda: self.addalbums(replace=True)),
+			("separator", None, None, None),
+			("Refresh", "", "artwork/folder-sync.png", self.populate_albums)
+		)
 		
-		self.playlistview.resizeColumnToContents(0)
-		self.playlistview.resizeColumnToContents(1)
+		self.populatemenu(menu, entries)
 		
-		self.playlist.setHorizontalHeaderLabels(["Song", "Len"])
+		menu.exec_(self.albumview.mapToGlobal(origin))
 	
-	def populate_library(self, root=""):
-		"""
-		Adds entries into the library model.
-		"""
-		Library.add(Player.lsinfo(root))
-		Library.lastroot = root # Save root so ".." works
-		self.liblist.clear()
-		
-		# Add dirs and files with different icons.
-		# Dirs will be listed first because the listing
-		# is sorted during .add().
-		# Dir listing will also always have special items "/" and "..".
-		for item in Library.get():
-			# Directory
-			if item.get("directory") != None:
-				if item.get("directory") == "":
-					name = "/"
-				elif item.get("directory") == "..":
-					name = ".."
-				else:
-					name = item["directory"].split("/")[-1]
-				
-				row = QtGui.QStandardItem(
-					QtGui.QIcon("artwork/inode-directory.png"),
-					name
-				)
-			# File
-			else:
-				row = QtGui.QStandardItem(
-					QtGui.QIcon("artwork/audio-x-generic.png"),
-					item["file"].split("/")[-1]
-				)
-			
-			row.setEditable(False)
-			
-			self.liblist.appendRow(row)
+	def addalbums(self, *args, replace=False):
+		self.addfilters([
+			index.data(QtCore.Qt.UserRole)
+			for index in self.albumview.selectionModel().selectedIndexes()
+		], replace)
 	
 	@require_connected
 	def play_selection(self, selection):
@@ -545,13 +3084,28 @@ class MainWindow(QtWidgets.QMainWindow):
 		"""
 		menu = QtWidgets.QMenu()
 		
-		entries = (
+		entries = [
 			#("Name", "Shortcut", "icon", action),
+			("Move up", "Ctrl+Up", "", lambda: self.moveselection(-1)),
+			("Move down", "Ctrl+Down", "", lambda: self.moveselection(1)),
+			("Remove", "Del", "artwork/list-remove.png", self.removeselection),
+			("separator", None, None, None)
+		]
+		
+		# Sorting needs the tags of every song
+		if not Playlist.windowed:
+			entries += [
+				("Sort by album", "", "", self.sortplaylist),
+				("Shuffle albums", "", "", self.shufflealbums),
+				("separator", None, None, None)
+			]
+		
+		entries += [
 			("Clear", "", "artwork/edit-clear-list.png", self.clearplaylist),
 			("separator", None, None, None),
 			("Connect", "", "artwork/network-connect.png", self.connect_mpd),
 			("Disconnect", "", "artwork/network-disconnect.png", self.disconnect_mpd)
-		)
+		]
 		
 		self.populatemenu(menu, entries)
 		
@@ -568,6 +3122,10 @@ class MainWindow(QtWidgets.QMainWindow):
 			("Add", "", "artwork/list-add.png", self.addplaylist),
 			("Replace", "", "artwork/edit-redo.png", self.replaceplaylist),
 			("separator", None, None, None),
+			("Add artist", "", "artwork/list-add.png", lambda: self.findadd()),
+			("Add album", "", "artwork/list-add.png", lambda: self.findadd(album=True)),
+			("Add matching...", "", "artwork/list-add.png", self.searchadd),
+			("separator", None, None, None),
 			("Update", "", "artwork/folder-new.png", self.updatelibrary),
 			("Rescan", "", "artwork/folder-sync.png", self.rescanlibrary)
 		)
@@ -597,6 +3155,13 @@ class MainWindow(QtWidgets.QMainWindow):
 		"""
 		Settings.port = self.portinput.text()
 	
+	def moreservers_changed(self):
+		"""
+		Run when return is pressed on
+		Settings->More servers
+		"""
+		Settings.moreservers = self.moreinput.text()
+	
 	def autoconn_checked(self, value):
 		"""
 		Run when Settings->Auto is checked
@@ -621,10 +3186,10 @@ class MainWindow(QtWidgets.QMainWindow):
 		Update MPD volume in in-/decrements of 5.
 		Round the change if necessary.
 		"""
-		# Always get current value instead of saving in update loop,
-		# otherwise this doesn't work properly when spamming changes.
-		curvol = int(Player.status().get("volume"))
-
+		# The bus is updated right after every change below,
+		# so spamming changes works without asking MPD.
+		curvol = int(Bus.status.get("volume", "-1"))
+		
 		if event.angleDelta().y() > 0:
 			newvol = curvol + 5
 			
@@ -638,45 +3203,76 @@ class MainWindow(QtWidgets.QMainWindow):
 		if 0 <= newvol <= 100:
 			Player.setvol(newvol)
 			QtWidgets.QToolTip.showText(QtGui.QCursor.pos(), str(newvol))
-			self.update_volbutton(newvol)
-
+			Bus.set("volume", str(newvol))
+	
 	def update_volbutton(self, val):
 		"""
 		Change the volbutton's icon to the appropriate one
 		based on MPD volume.
 		"""
 		if 70 <= val <= 100:
-			self.volbutton.setIcon(self.volhighicon)
+			self.render(self.volbutton, "setIcon", self.volhighicon)
 		elif 40 <= val <= 65:
-			self.volbutton.setIcon(self.volmidicon)
+			self.render(self.volbutton, "setIcon", self.volmidicon)
 		elif 5 <= val <= 35:
-			self.volbutton.setIcon(self.vollowicon)
+			self.render(self.volbutton, "setIcon", self.vollowicon)
 		elif val == 0:
-			self.volbutton.setIcon(self.volmuteicon)
+			self.render(self.volbutton, "setIcon", self.volmuteicon)
+		
+		self.render(self.volbutton, "setToolTip", str(val))
+	
+	def render(self, widget, setter, value):
+		"""
+		Call a widget's setter only when the value differs from
+		the one rendered last. setIcon and friends repaint even
+		when nothing changed.
+		"""
+		key = (widget, setter)
 		
-		self.volbutton.setToolTip(str(val))
+		if key in self.rendered and self.rendered[key] == value: return
 		
-	def update_songchanged(self, song={}, now=0, prev=0):
+		self.rendered[key] = value
+		getattr(widget, setter)(value)
+	
+	def memorystats(self):
 		"""
-		Update required GUI components when the current
-		song changes in MPD.
+		Sizes of the models and caches, logged in diagnostics mode.
 		"""
-		coverpath = os_path.join(
-			Settings.musicdir,
-			os_path.dirname(song["file"]),
-			"cover.jpg"
-		)
+		def items(parent):
+			# Items of a QStandardItemModel, children included
+			return parent.rowCount() + sum(
+				items(parent.child(row)) for row in range(parent.rowCount())
+				if parent.child(row).hasChildren()
+			)
 		
-		if os_path.exists(coverpath):
-			self.albumcover.setPixmap(QtGui.QPixmap(coverpath))
-		else:
-			self.albumcover.setPixmap(self.nocover)
-
+		return {
+			"playlist songs": len(Playlist.get()),
+			"playlist ids": len(Playlist.ids),
+			"playlist windows": len(Playlist.windows),
+			"library entries": len(Library.get()),
+			"library items": items(self.liblist.invisibleRootItem()),
+			"stored playlists": len(StoredPlaylists.get()),
+			"stored playlists cached": len(StoredPlaylists.cache),
+			"stored playlist items": items(self.storedlists.invisibleRootItem()),
+			"tag cache nodes": len(TagCache.cache),
+			"tag browser items": items(self.taglist.invisibleRootItem()),
+			"albums": self.albums.rowCount(),
+			"covers cached": len(CoverLoader.cache),
+			"covers cached KiB": sum(
+				pixmap.width() * pixmap.height() * pixmap.depth() // 8192
+				for pixmap in CoverLoader.cache.values()
+			),
+			"covers loading": len(CoverLoader.pending),
+			"servers": len(self.servers)
+		}
+	
+	def songlabels(self, song):
+		"""
+		The title and artist lines shown for a song.
+		"""
 		title = song.get("title", song["file"])
 		artist = song.get("artist", False)
 		album = song.get("album", False)
-	
-		self.songtitle.setText(title)
 		
 		if all([artist, album]):
 			text = "{0} (on {1})".format(
@@ -686,31 +3282,73 @@ class MainWindow(QtWidgets.QMainWindow):
 		# Tags missing
 		else:
 			text = "Tags missing!"
-
-		self.songwriter.setText(text)
 		
-		self.songslider.setRange(0, int(song["time"]))
+		return title, text
+	
+	@require_connected
+	def prefetch(self, songid):
+		"""
+		Prepare the next song ahead of time, its cover is
+		loaded into the cover cache and its labels formatted,
+		so the song change is shown in one go.
+		"""
+		if songid == self.nextlabels[0]: return
+		
+		row = Playlist.row(songid)
 		
-		# Bold current song
-		# Don't unbold if no last song
-		if prev >= 0:
-			text = self.playlist.item(prev, 0)
-			font = text.font()
-			font.setBold(False)
-			text.setFont(font)
+		# Not streamed in yet, tried again on the next update
+		if row is None: return
+		
+		song = self.complete(row)
 		
-		text = self.playlist.item(now, 0)
-		font = text.font()
-		font.setBold(True)
-		text.setFont(font)
+		self.nextlabels = (songid, self.songlabels(song))
+		CoverLoader.get(coverpath(song.file), self.albumcover.width())
 	
-	def update_playing(self, time=""):
+	def show_cover(self, key):
 		"""
-		Update required GUI components during playing.
+		Show the current song's cover once it's loaded.
+		"""
+		if key != self.coverkey: return
+		
+		pixmap = CoverLoader.cache.get(key)
+		
+		if pixmap is None or pixmap.isNull():
+			self.render(self.albumcover, "setPixmap", self.nocover)
+		else:
+			self.render(self.albumcover, "setPixmap", pixmap)
+	
+	def update_songchanged(self, song={}):
 		"""
-		now, end = [int(i) for i in time.split(":")]
+		Update required GUI components when the current
+		song changes in MPD.
+		"""
+		# Normally prefetched, otherwise show_cover() sets it later
+		self.coverkey = (coverpath(song["file"]), self.albumcover.width())
+		pixmap = CoverLoader.get(*self.coverkey)
+		
+		if pixmap is None or pixmap.isNull():
+			self.render(self.albumcover, "setPixmap", self.nocover)
+		else:
+			self.render(self.albumcover, "setPixmap", pixmap)
+		
+		if self.nextlabels[0] == song.id:
+			title, text = self.nextlabels[1]
+		else:
+			title, text = self.songlabels(song)
+		
+		self.render(self.songtitle, "setText", title)
+		self.render(self.songwriter, "setText", text)
 		
-		self.songlength.setText(
+		self.songslider.setRange(0, song.time)
+		
+		# Bold current song
+		self.playlist.setcurrent(song.id)
+	
+	def update_playing(self, now=0, end=0):
+		"""
+		Update required GUI components during playing.
+		"""
+		self.render(self.songlength, "setText",
 			"{0} / {1}".format(
 				propertime(now),
 				propertime(end)
@@ -725,11 +3363,12 @@ class MainWindow(QtWidgets.QMainWindow):
 		"""
 		Update required GUI components when MPD is stopped.
 		"""
-		self.songtitle.setText("Stopped")
-		self.songwriter.setText("")
-		self.songlength.setText("")
+		self.render(self.songtitle, "setText", "Stopped")
+		self.render(self.songwriter, "setText", "")
+		self.render(self.songlength, "setText", "")
 		
-		self.albumcover.setPixmap(self.nocover)
+		self.coverkey = None
+		self.render(self.albumcover, "setPixmap", self.nocover)
 		
 		self.songslider.setValue(0)
 	
@@ -737,65 +3376,206 @@ class MainWindow(QtWidgets.QMainWindow):
 	def update(self):
 		"""
 		This is the main loop that is run by a timer.
-		Detect changes in MPD status:
-		- playlist is changed
-		- current song is changed
-		- state changes (playing/paused/stopped)
-		"""
-		status = Player.status()
-
-		# This key is missing if MPD hasn't played anything yet,
-		# prevents a KeyError.
-		song = int(status.get("song", "0"))	
-
-		# --- Update playlist if changed.
-		if status["playlist"] != Playlist.lastversion:
-			self.populate_playlist()
-
-			# Bold current song again since the playlist was
-			# recreated.
-			# Skip on empty playlist
-			if self.playlist.rowCount():
-				text = self.playlist.item(song, 0)
-				font = text.font()
-				font.setBold(True)
-				text.setFont(font)
-		
-		Playlist.lastversion = status["playlist"]
-		
-		# --- Update song information if changed.
-		
-		if song != Player.lastsong or \
-		status["state"] == "play" and Player.laststate == "stop":
-			try: self.update_songchanged(
-				Playlist.get(song),
-				song,
-				Player.lastsong
-			)
-			except: pass # Fails on cleared playlist.
+		Status is handed to the event bus, which
+		tells the widgets what changed.
+		"""
+		Bus.publish(Player.status())
+		
+		self.reschedule()
+	
+	def reschedule(self):
+		"""
+		Adapt the polling interval: fast while playing, slow
+		while paused or stopped, slowest while nobody can see
+		the window, and fastest for a moment after user input.
+		"""
+		if not self.timer.isActive(): return
+		
+		if time.monotonic() < self.inputuntil:
+			mode = "input"
+		elif self.isHidden() or self.isMinimized():
+			mode = "hidden"
+		elif Bus.status.get("state") == "play":
+			mode = "play"
+		else:
+			mode = "pause"
+		
+		pushed = self.server is not None and self.server.watcher.notifier is not None
+		rate = self.pollrates[mode][pushed]
+		
+		if rate != self.timer.interval():
+			self.timer.setInterval(rate)
+	
+	def user_input(self, *args):
+		"""
+		Poll fast for a moment after user input,
+		so the results of actions show up right away.
+		"""
+		if not self.timer.isActive(): return
+		
+		self.inputuntil = time.monotonic() + 2
+		
+		if self.timer.interval() > self.pollrates["input"][0]:
+			self.timer.start(self.pollrates["input"][0])
+	
+	def watch_input(self):
+		"""
+		Connect the signals of the window's controls to user_input(),
+		Qt only calls back when they're used, not for every event.
+		"""
+		for button in self.findChildren(QtWidgets.QAbstractButton):
+			button.pressed.connect(self.user_input)
+		
+		for slider in self.findChildren(QtWidgets.QAbstractSlider):
+			slider.actionTriggered.connect(self.user_input)
+		
+		for view in self.findChildren(QtWidgets.QAbstractItemView):
+			view.pressed.connect(self.user_input)
+			view.activated.connect(self.user_input)
+		
+		for box in self.findChildren(QtWidgets.QComboBox):
+			box.activated.connect(self.user_input)
+		
+		for line in self.findChildren(QtWidgets.QLineEdit):
+			line.returnPressed.connect(self.user_input)
+		
+		# Shortcuts
+		for action in self.findChildren(QtWidgets.QAction):
+			action.triggered.connect(self.user_input)
+	
+	def visibility_changed(self):
+		"""
+		Hidden or minimized windows aren't updated, the event bus
+		holds the changes and they're shown in one go once the
+		window can be seen again, e.g. one playlist diff instead
+		of every version in between.
+		"""
+		if self.isHidden() or self.isMinimized():
+			Bus.hold()
+		else:
+			Bus.release()
+		
+		self.reschedule()
+	
+	def changeEvent(self, event):
+		# Minimized or restored
+		if event.type() == QtCore.QEvent.WindowStateChange:
+			self.visibility_changed()
+		
+		super(MainWindow, self).changeEvent(event)
+	
+	def showEvent(self, event):
+		self.visibility_changed()
+		super(MainWindow, self).showEvent(event)
+	
+	def hideEvent(self, event):
+		self.visibility_changed()
+		super(MainWindow, self).hideEvent(event)
+	
+	@require_connected
+	def playlist_changed(self, version, length):
+		"""
+		Update playlist if changed.
+		"""
+		# A newer version cancels a playlist that's still streaming,
+		# a complete one is updated with a diff if it's small.
+		if version != Playlist.lastversion:
+			if self.loader or not Playlist.lastversion or \
+			not self.update_playlist(length):
+				self.populate_playlist(length)
+		
+		Playlist.lastversion = version
+	
+	def update_playlist(self, length):
+		"""
+		Bring the playlist up to date with the changes since its
+		version. Songs that only moved are reused, new ones are
+		fetched in one command list. False if there are too many
+		new songs, streaming the whole playlist is faster then.
+		"""
+		changes = [
+			(int(item["cpos"]), int(item["id"]))
+			for item in Player.plchangesposid(Playlist.lastversion)
+		]
+		
+		new = [songid for pos, songid in changes if Playlist.row(songid) is None]
+		
+		fetched = {}
+		
+		# Windowed playlists fetch tags once the rows are in view
+		if Playlist.windowed:
+			fetched = {songid: Playlist.stub(-1, songid) for songid in new}
+			self.windowtimer.start()
+		elif len(new) > self.chunksize:
+			return False
+		elif new:
+			Player.command_list_ok_begin()
+			
+			for songid in new:
+				Player.playlistid(songid)
+			
+			try: found = Player.command_list_end()
+			except CommandError: return False # Gone meanwhile
+			
+			for items in found:
+				song = Song(items[0])
+				fetched[song.id] = song
+		
+		songs = []
 		
-		Player.lastsong = song
+		for pos, songid in changes:
+			song = fetched.get(songid) or Playlist.get(Playlist.row(songid))
+			song.pos = pos
+			songs.append(song)
 		
-		# --- Update basic information if changed.
+		self.playlist.change(length, songs)
 		
-		state = status.get("state")
+		return True
+	
+	def song_changed(self, *args):
+		"""
+		Update song information if changed.
+		"""
+		songid = int(Bus.status.get("songid", "-1"))
+		
+		# Rows are looked up by songid, songs moving around
+		# only change the row, not the song.
+		song = Playlist.row(songid)
+		
+		# Wait for the current song to be streamed in,
+		# populate_chunk() calls this again.
+		if self.loader and song is None: return
+		
+		# Cleared playlist has no current song.
+		if song is not None:
+			try: self.update_songchanged(self.complete(song))
+			except: pass
+		
+		if Bus.status.get("state") == "stop":
+			self.update_stopped()
 		
+		Player.lastsongid = songid
+	
+	def state_changed(self, state):
+		"""
+		Update basic information if changed.
+		"""
 		if state == "play":
-			self.playbutton.setIcon(self.pauseicon)
-			self.update_playing(status["time"])
+			self.render(self.playbutton, "setIcon", self.pauseicon)
 		
 		elif state == "pause":
-			self.playbutton.setIcon(self.starticon)
+			self.render(self.playbutton, "setIcon", self.starticon)
 		
 		elif state == "stop":
-			self.playbutton.setIcon(self.starticon)
+			self.render(self.playbutton, "setIcon", self.starticon)
 			self.update_stopped()
 		
-		Player.laststate = state
-		
-		# --- Update volume button
-		self.update_volbutton(int(status["volume"]))
+		# Stopping clears the song information
+		if Player.laststate == "stop" and state != "stop":
+			self.song_changed()
 		
+		Player.laststate = state
+	
 	def __init__(self, parent=None, app=None):
 		super(MainWindow, self).__init__()
 		
@@ -807,6 +3587,34 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.timer = QtCore.QTimer()
 		self.timer.timeout.connect(self.update)
 		
+		# Active server, set by switch_server()
+		self.server = None
+		self.opened.connect(self.server_opened)
+		
+		# Polling is fast until then, see user_input()
+		self.inputuntil = 0
+		
+		# (widget, setter) -> value last set, see render()
+		self.rendered = {}
+		
+		Bus.playlist.connect(self.playlist_changed)
+		Bus.song.connect(self.song_changed)
+		Bus.nextsong.connect(self.prefetch)
+		Bus.state.connect(self.state_changed)
+		Bus.elapsed.connect(self.update_playing)
+		Bus.volume.connect(self.update_volbutton)
+		Bus.updating.connect(self.updating_changed)
+		Bus.database.connect(self.database_changed)
+		Bus.storedlists.connect(self.storedlists_changed)
+		
+		# Playlist streaming, see populate_playlist()
+		self.loader = None
+		self.loaderitems = None
+		self.chunksize = 500
+		
+		# Longer playlists are windowed, see PlaylistObj
+		self.windowfrom = 20000
+		
 		# Set size and position from memory
 		self.resize(Settings.winsize)
 		
@@ -849,11 +3657,18 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.albumcover.setScaledContents(True)
 		
 		self.nocover = QtGui.QPixmap("artwork/nocover.png")
-		self.albumcover.setPixmap(self.nocover)
+		self.render(self.albumcover, "setPixmap", self.nocover)
+		
+		# Cover shown or being loaded, (path, size)
+		self.coverkey = None
+		CoverLoader.loaded.connect(self.show_cover)
+		
+		# Songid and labels of the prefetched next song
+		self.nextlabels = (-1, None)
 		
 		# Song name
 		self.songtitle  = QtWidgets.QLabel()
-		self.songtitle.setText("Disconnected")
+		self.render(self.songtitle, "setText", "Disconnected")
 		self.songtitle.setStyleSheet("font-weight: bold; font-size: 12px;")
 
 		self.songtitle.setSizePolicy(
@@ -892,7 +3707,12 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.starticon = QtGui.QIcon("artwork/media-playback-start.png")
 		self.pauseicon = QtGui.QIcon("artwork/media-playback-pause.png")
 		
-		self.playbutton.setIcon(self.starticon)
+		# Server switcher state icons
+		self.pausedicon  = self.pauseicon
+		self.stopicon    = QtGui.QIcon("artwork/media-playback-stop.png")
+		self.offlineicon = QtGui.QIcon("artwork/network-disconnect.png")
+		
+		self.render(self.playbutton, "setIcon", self.starticon)
 		
 		self.playbutton.clicked.connect(self.playsong)
 		
@@ -934,39 +3754,157 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.volmidicon  = QtGui.QIcon("artwork/audio-volume-medium.png")
 		self.vollowicon  = QtGui.QIcon("artwork/audio-volume-low.png")
 		
-		self.volbutton.setIcon(self.volhighicon)
+		self.render(self.volbutton, "setIcon", self.volhighicon)
 		
 		self.volbutton.wheelEvent = self.volbutton_changed
 		
+		# Server switcher, only shown with more than one server
+		self.servers = []
+		
+		self.serverbox = QtWidgets.QComboBox()
+		self.serverbox.setFocusPolicy(QtCore.Qt.NoFocus)
+		self.serverbox.hide()
+		
+		self.serverbox.activated.connect(self.switch_server)
+		
 		# TabWidget and Views
 		tabs = QtWidgets.QTabWidget()
+		self.tabs = tabs
 		
-		self.playlist = QtGui.QStandardItemModel()
-		self.playlist.setColumnCount(2)
-		self.playlist.setHorizontalHeaderLabels(["Song", "Len"])
+		self.playlist = PlaylistModel(self)
 		
 		self.playlistview = QtWidgets.QTreeView()
 		
 		self.playlistview.setRootIsDecorated(False)
 		self.playlistview.setAlternatingRowColors(True)
 		self.playlistview.header().setSectionsMovable(False)
-		self.playlistview.header().setStretchLastSection(True)
 		self.playlistview.setModel(self.playlist)
 		
+		# Sizing must not depend on the number of rows:
+		# all rows are the same height, the song column takes
+		# what's left after the length column, which is sized
+		# for the widest length text instead of measuring every row.
+		self.playlistview.setUniformRowHeights(True)
+		
+		header = self.playlistview.header()
+		header.setStretchLastSection(False)
+		header.setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+		header.setSectionResizeMode(1, QtWidgets.QHeaderView.Fixed)
+		header.resizeSection(1,
+			self.playlistview.fontMetrics().width("000:00") + 16
+		)
+		
 		self.playlistview.activated.connect(self.play_selection)
 		self.playlistview.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
 		self.playlistview.customContextMenuRequested.connect(self.playlistmenu)
 		
+		# Songs are rearranged by dragging a selection of rows
+		self.playlistview.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+		self.playlistview.setDragDropMode(QtWidgets.QAbstractItemView.InternalMove)
+		self.playlistview.setDropIndicatorShown(True)
+		self.playlist.dropped.connect(self.moverows)
+		
+		# Tags of windowed playlists are fetched once scrolling pauses
+		self.windowtimer = QtCore.QTimer(self)
+		self.windowtimer.setSingleShot(True)
+		self.windowtimer.setInterval(50)
+		self.windowtimer.timeout.connect(self.fetch_visible)
+		
+		self.playlistview.verticalScrollBar().valueChanged.connect(
+			lambda value: self.windowtimer.start()
+		)
+		self.playlist.rowsInserted.connect(lambda *args: self.windowtimer.start())
+		
 		self.liblist = QtGui.QStandardItemModel()
 		
 		self.libview = QtWidgets.QListView()
 		self.libview.setAlternatingRowColors(True)
+		self.libview.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
 		self.libview.setModel(self.liblist)
 		
 		self.libview.activated.connect(self.libitem_clicked)
 		self.libview.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
 		self.libview.customContextMenuRequested.connect(self.librarymenu)
 		
+		# Tag browser, shares the library tab
+		self.taglist = QtGui.QStandardItemModel()
+		
+		self.tagview = QtWidgets.QTreeView()
+		self.tagview.setHeaderHidden(True)
+		self.tagview.setUniformRowHeights(True)
+		self.tagview.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+		self.tagview.setModel(self.taglist)
+		
+		self.tagview.expanded.connect(self.tagnode_expanded)
+		self.tagview.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+		self.tagview.customContextMenuRequested.connect(self.tagmenu)
+		
+		# Album cover grid, covers are loaded for visible cells only
+		coversize = 96
+		self.albums = AlbumModel(coversize, self)
+		
+		self.albumview = QtWidgets.QListView()
+		self.albumview.setFlow(QtWidgets.QListView.LeftToRight)
+		self.albumview.setWrapping(True)
+		self.albumview.setResizeMode(QtWidgets.QListView.Adjust)
+		self.albumview.setUniformItemSizes(True)
+		self.albumview.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+		self.albumview.setLayoutMode(QtWidgets.QListView.Batched)
+		self.albumview.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+		self.albumview.setItemDelegate(
+			AlbumDelegate(coversize, self.fontMetrics().height(), self.albumview)
+		)
+		self.albumview.setModel(self.albums)
+		
+		self.albumview.activated.connect(self.addalbums)
+		self.albumview.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+		self.albumview.customContextMenuRequested.connect(self.albummenu)
+		
+		# Directory lookups and cancelling wait until scrolling pauses
+		self.albumtimer = QtCore.QTimer(self)
+		self.albumtimer.setSingleShot(True)
+		self.albumtimer.setInterval(100)
+		self.albumtimer.timeout.connect(self.albums_settled)
+		
+		self.albums.unresolved.connect(self.albumtimer.start)
+		self.albumview.verticalScrollBar().valueChanged.connect(self.albumtimer.start)
+		
+		self.libmode = QtWidgets.QComboBox()
+		self.libmode.addItems(["Folders", "Artists", "Genres", "Albums"])
+		self.libmode.currentIndexChanged.connect(self.libmode_changed)
+		
+		self.libstack = QtWidgets.QStackedWidget()
+		self.libstack.addWidget(self.libview)
+		self.libstack.addWidget(self.tagview)
+		self.libstack.addWidget(self.albumview)
+		
+		libtab = QtWidgets.QWidget()
+		libtablayout = QtWidgets.QVBoxLayout(libtab)
+		libtablayout.setContentsMargins(0,0,0,0)
+		libtablayout.setSpacing(0)
+		libtablayout.addWidget(self.libmode)
+		libtablayout.addWidget(self.libstack)
+		
+		# Busy while update jobs run
+		self.updatebar = QtWidgets.QProgressBar()
+		self.updatebar.setRange(0, 0)
+		self.updatebar.setTextVisible(True)
+		self.updatebar.hide()
+		libtablayout.addWidget(self.updatebar)
+		
+		self.storedlists = QtGui.QStandardItemModel()
+		
+		self.storedview = QtWidgets.QTreeView()
+		self.storedview.setHeaderHidden(True)
+		self.storedview.setUniformRowHeights(True)
+		self.storedview.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+		self.storedview.setModel(self.storedlists)
+		
+		self.storedview.expanded.connect(self.storedlist_expanded)
+		self.storedview.activated.connect(self.storedlist_activated)
+		self.storedview.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+		self.storedview.customContextMenuRequested.connect(self.storedmenu)
+		
 		
 		
 		# Add hotkeys to playlist, library
@@ -985,11 +3923,40 @@ class MainWindow(QtWidgets.QMainWindow):
 		play.triggered.connect(self.play_selection)
 		self.playlistview.addAction(play)
 		
+		moveup = QtWidgets.QAction("Move up", self.playlistview)
+		moveup.setShortcut("Ctrl+Up")
+		moveup.setShortcutContext(QtCore.Qt.WidgetShortcut)
+		moveup.triggered.connect(lambda: self.moveselection(-1))
+		self.playlistview.addAction(moveup)
+		
+		movedown = QtWidgets.QAction("Move down", self.playlistview)
+		movedown.setShortcut("Ctrl+Down")
+		movedown.setShortcutContext(QtCore.Qt.WidgetShortcut)
+		movedown.triggered.connect(lambda: self.moveselection(1))
+		self.playlistview.addAction(movedown)
+		
+		remove = QtWidgets.QAction("Remove", self.playlistview)
+		remove.setShortcut("Del")
+		remove.setShortcutContext(QtCore.Qt.WidgetShortcut)
+		remove.triggered.connect(self.removeselection)
+		self.playlistview.addAction(remove)
+		
 		libsel = QtWidgets.QAction("Select", self.libview)
 		libsel.setShortcut("Space")
 		libsel.triggered.connect(self.addplaylist)
 		self.libview.addAction(libsel)
 		
+		storedload = QtWidgets.QAction("Load", self.storedview)
+		storedload.setShortcut("Return")
+		storedload.setShortcutContext(QtCore.Qt.WidgetShortcut)
+		storedload.triggered.connect(self.loadstored)
+		self.storedview.addAction(storedload)
+		
+		# Progress of playlist streaming
+		self.loadbar = QtWidgets.QProgressBar()
+		self.loadbar.setFormat("Loading playlist %v / %m")
+		self.loadbar.hide()
+		
 		# Search box
 		self.searchbox = QtWidgets.QLineEdit()
 		self.searchbox.hide()
@@ -1010,14 +3977,19 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.mdirinput   = QtWidgets.QLineEdit(settingsctr)
 		self.serverinput = QtWidgets.QLineEdit(settingsctr)
 		self.portinput   = QtWidgets.QLineEdit(settingsctr)
+		self.moreinput   = QtWidgets.QLineEdit(settingsctr)
 		
 		self.mdirinput.setText(Settings.musicdir)
 		self.serverinput.setText(Settings.server)
 		self.portinput.setText(Settings.port)
+		self.moreinput.setText(Settings.moreservers)
+		
+		self.moreinput.setToolTip("Comma separated host:port list")
 		
 		self.mdirinput.returnPressed.connect(self.mdir_changed)
 		self.serverinput.returnPressed.connect(self.server_changed)
 		self.portinput.returnPressed.connect(self.port_changed)
+		self.moreinput.returnPressed.connect(self.moreservers_changed)
 		
 		autoconn = QtWidgets.QCheckBox(settingsctr)
 		
@@ -1029,6 +4001,7 @@ class MainWindow(QtWidgets.QMainWindow):
 		settingstab.addRow("Cover dir:", self.mdirinput)
 		settingstab.addRow("Server:", self.serverinput)
 		settingstab.addRow("Port:", self.portinput)
+		settingstab.addRow("More servers:", self.moreinput)
 		settingstab.addRow("Auto:", autoconn)
 		
 		
@@ -1040,11 +4013,17 @@ class MainWindow(QtWidgets.QMainWindow):
 		)
 		
 		tabs.addTab(
-			self.libview,
+			libtab,
 			QtGui.QIcon("artwork/folder-sound.png"),
 			"Library"
 		)
 		
+		tabs.addTab(
+			self.storedview,
+			QtGui.QIcon("artwork/folder-favorites.png"),
+			"Playlists"
+		)
+		
 		tabs.addTab(
 			settingsctr,
 			QtGui.QIcon("artwork/preferences-other.png"),
@@ -1054,6 +4033,8 @@ class MainWindow(QtWidgets.QMainWindow):
 		# Essentially sets the main window's minimum size
 		tabs.setMinimumSize(350, 150)
 		
+		tabs.currentChanged.connect(self.storedtab_shown)
+		
 		# Add hotkeys to tabs
 		
 		tab1 = QtWidgets.QAction("Tab1", tabs)
@@ -1063,7 +4044,7 @@ class MainWindow(QtWidgets.QMainWindow):
 		
 		tab2 = QtWidgets.QAction("Tab2", tabs)
 		tab2.setShortcut("F2")
-		tab2.triggered.connect(lambda: tabs.setCurrentWidget(self.libview))
+		tab2.triggered.connect(lambda: tabs.setCurrentWidget(libtab))
 		tabs.addAction(tab2)
 		
 		tab3 = QtWidgets.QAction("Tab3", tabs)
@@ -1071,11 +4052,10 @@ class MainWindow(QtWidgets.QMainWindow):
 		tab3.triggered.connect(lambda: tabs.setCurrentWidget(settingsctr))
 		tabs.addAction(tab3)
 		
-		# TODO
-		#tab4 = QtWidgets.QAction("", tabs)
-		#tab4.setShortcut("")
-		#tab4.triggered.connect()
-		#tabs.addAction(tab4)
+		tab4 = QtWidgets.QAction("Tab4", tabs)
+		tab4.setShortcut("F4")
+		tab4.triggered.connect(lambda: tabs.setCurrentWidget(self.storedview))
+		tabs.addAction(tab4)
 		
 		
 		# --- Create our layouts
@@ -1133,6 +4113,7 @@ class MainWindow(QtWidgets.QMainWindow):
 		ctrllayout.addWidget(self.playbutton)
 		ctrllayout.addWidget(stopbutton)
 		ctrllayout.addWidget(nextbutton)
+		ctrllayout.addWidget(self.serverbox)
 		ctrllayout.addWidget(self.volbutton)
 		
 		ctrllayout.setAlignment(self.volbutton, QtCore.Qt.AlignRight)
@@ -1143,19 +4124,51 @@ class MainWindow(QtWidgets.QMainWindow):
 		textlayout.addWidget(ctrlwidgets)
 		mainlayout.addWidget(self.songslider)
 		mainlayout.addWidget(tabs)
+		mainlayout.addWidget(self.loadbar)
 		mainlayout.addWidget(self.searchbox)
 		
 		self.setCentralWidget(mainwidget)
 		
+		self.watch_input()
+		
 		if autoconn.isChecked():
 			self.connect_mpd()
 
 
 
 if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Cantapyle MPD client.")
+	parser.add_argument("--diagnostics", type=int, metavar="SECONDS",
+		help="log memory use and object counts every SECONDS seconds"
+	)
+	parser.add_argument("--diagnostics-log", metavar="FILE",
+		help="append the memory log to FILE instead of stderr"
+	)
+	parser.add_argument("--record", metavar="FILE",
+		help="record the MPD traffic to FILE, for replay.py"
+	)
+	
+	args = parser.parse_args()
+	
+	if args.record:
+		record(args.record)
+	
 	app = QtWidgets.QApplication([])
 	
+	if args.diagnostics:
+		from diagnostics import MemoryMonitor
+		
+		if args.diagnostics_log:
+			log = open(args.diagnostics_log, "a")
+		else:
+			log = sys.stderr
+		
+		monitor = MemoryMonitor(args.diagnostics, log)
+	
 	mwin = MainWindow(app=app)
 	mwin.show()
 	
+	if args.diagnostics:
+		monitor.start(mwin, mwin.memorystats)
+	
 	exit(app.exec_())
@@ -0,0 +1,207 @@
+"""
+MPD connection shared by the GUI and the command line client.
+Doesn't import Qt, so scripts using it start fast.
+"""
+
+import json
+import threading
+import time
+
+from mpd import MPDClient
+
+class RecorderObj(object):
+	"""
+	Records the MPD traffic of every PlayerObj connection to a
+	file, for replay.py. One JSON object per line, either the
+	hello of a new connection or a request with its reply, when
+	it was sent and how long the reply took. Connections are
+	also opened from pool threads, so writes are locked.
+	"""
+	def write(self, record):
+		line = json.dumps(record) + "\n"
+		
+		with self.lock:
+			self.file.write(line)
+			self.file.flush()
+	
+	def open(self, hello):
+		"""
+		Start recording a new connection, returns its number.
+		"""
+		with self.lock:
+			self.connections += 1
+			conn = self.connections
+		
+		self.write({
+			"conn": conn,
+			"t": round(time.monotonic() - self.started, 6),
+			"hello": hello
+		})
+		
+		return conn
+	
+	def __init__(self, path):
+		self.file = open(path, "w")
+		self.started = time.monotonic()
+		self.connections = 0
+		self.lock = threading.Lock()
+
+# Set by record()
+Recorder = None
+
+def record(path):
+	"""
+	Record all connections opened from now on to path.
+	"""
+	global Recorder
+	Recorder = RecorderObj(path)
+
+class RecordingFile(object):
+	"""
+	Stands in for the read side of an MPD connection and
+	puts requests and replies together for the recorder.
+	"""
+	def sent(self, line):
+		if self.reply:
+			self.flush()
+		
+		if not self.request:
+			self.sentat = time.monotonic()
+		
+		self.request.append(line + "\n")
+		self.lastsent = time.monotonic()
+	
+	def received(self, data):
+		# Server latency only, not the time spent consuming the reply
+		if not self.reply:
+			self.firstat = time.monotonic()
+		
+		# Binary data (albumart) survives JSON this way
+		self.reply.append(data.decode("utf-8", "surrogateescape"))
+	
+	def flush(self):
+		Recorder.write({
+			"conn": self.conn,
+			"t": round(self.sentat - Recorder.started, 6),
+			"request": "".join(self.request),
+			"reply": "".join(self.reply),
+			"wait": round(max(self.firstat - self.lastsent, 0), 6)
+		})
+		
+		self.request = []
+		self.reply = []
+	
+	def readline(self, *args):
+		line = self.file.readline(*args)
+		self.received(line)
+		
+		# End of the reply
+		if line == b"OK\n" or line.startswith(b"ACK ") or not line:
+			self.flush()
+		
+		return line
+	
+	def read(self, *args):
+		data = self.file.read(*args)
+		self.received(data)
+		
+		return data
+	
+	def close(self):
+		self.file.close()
+	
+	def __init__(self, file, conn):
+		self.file = file
+		self.conn = conn
+		
+		self.request = []
+		self.reply = []
+		self.sentat = self.lastsent = self.firstat = time.monotonic()
+
+class PlayerObj(MPDClient):
+	"""
+	Wrapper for the MPDClient object.
+	"""
+	def connect(self, host, port):
+		super(PlayerObj, self).connect(host, port)
+		self.connected = True
+		
+		# Saved so additional connections can be opened
+		self.host = host
+		self.port = port
+		
+		if Recorder:
+			self.recording = RecordingFile(
+				self._rbfile,
+				Recorder.open("OK MPD {0}\n".format(self.mpd_version))
+			)
+			self._rbfile = self.recording
+	
+	def _write_line(self, line):
+		if self.recording:
+			self.recording.sent(line)
+		
+		super(PlayerObj, self)._write_line(line)
+	
+	def disconnect(self):
+		self.connected = False
+		self.recording = None
+		super(PlayerObj, self).disconnect()
+	
+	def reset(self):
+		self.lastsongid = -1
+		self.laststate = None
+	
+	def __init__(self):
+		super(PlayerObj, self).__init__()
+
+		self.timeout = 10 # Timeout for connecting
+		
+		# Used to detect when song changes,
+		# Updated by GUI timer.
+		# Keyed on songid so moving songs around the
+		# current one doesn't look like a song change.
+		self.lastsongid = -1
+		
+		# Used to detect when MPD state changes.
+		# (Playing,Paused,Stopped).
+		# Updated by GUI timer.
+		self.laststate = None
+		
+		self.connected = False
+		
+		# RecordingFile while recording
+		self.recording = None
+
+
+
+# This would support displaying hours, not what I want currently.
+#def propertime(secs = 0):
+	#m, s = divmod(secs, 60)
+	#h, m = divmod(m, 60)
+	
+	#return "%02d:%02d:%02d" % (h, m, s) if h else "%d:%02d" % (m, s)
+
+# Turn seconds into M:SS format.
+def propertime(sec=0): return "{0}:{1:02d}".format(int(sec / 60), sec % 60)
+
+def serverlist(server, port, more=""):
+	"""
+	Turn the server settings into (host, port) pairs,
+	the main server first, followed by the comma separated
+	"host:port" entries of the "More servers" setting.
+	"""
+	servers = [(server, port)]
+	
+	for entry in more.split(","):
+		entry = entry.strip()
+		
+		if not entry: continue
+		
+		host, sep, port = entry.rpartition(":")
+		
+		if not sep: host, port = entry, "6600"
+		
+		servers.append((host, port))
+	
+	return servers
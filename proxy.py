@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+
+"""
+Caching MPD proxy, lets many clients share one MPD connection.
+
+Clients connect to the proxy as if it was MPD. Reads of status,
+currentsong, playlistinfo and lsinfo are served from a cache that
+is kept fresh by a single upstream connection in idle mode, the
+proxy also answers the clients' own idle commands. Everything else
+is passed through one shared upstream connection.
+
+So the load on MPD stays the same no matter how many clients
+(e.g. Cantapyle instances) poll the proxy.
+
+With --password the shared connection has the permissions that
+password gives, so clients have to send that same password before
+they get to use it. Other passwords MPD knows would grant less.
+
+Examples:
+	proxy.py
+	proxy.py --listen 0.0.0.0:6601 --server musicbox:6600
+"""
+
+import argparse
+import asyncio
+import shlex
+import sys
+import time
+
+from cli import Settings
+
+OK = b"OK\n"
+
+# Served from the cache, keyed on the full command line
+CACHED = ("status", "currentsong", "playlistinfo", "lsinfo")
+
+# Idle subsystems and the cached commands they make stale
+INVALIDATES = {
+	"player": ("status", "currentsong"),
+	"mixer": ("status",),
+	"options": ("status",),
+	"playlist": ("status", "currentsong", "playlistinfo"),
+	"database": ("status", "lsinfo"),
+	"update": ("status",),
+	"stored_playlist": ("lsinfo",)
+}
+
+# Passed through, but can't change anything cached
+READONLY = (
+	"ping", "stats", "find", "search", "count", "list", "listall",
+	"listallinfo", "listfiles", "listplaylists", "listplaylist",
+	"listplaylistinfo", "plchanges", "plchangesposid", "playlistid",
+	"playlistfind", "playlistsearch", "outputs", "commands",
+	"notcommands", "tagtypes", "urlhandlers", "decoders", "config",
+	"albumart", "readpicture", "readcomments", "replay_gain_status",
+	"channels", "readmessages", "getfingerprint", "sticker"
+)
+
+async def readresponse(reader):
+	"""
+	Read one complete response (up to OK or ACK) from MPD.
+	Binary chunks of albumart/readpicture are passed along as is.
+	"""
+	lines = []
+	
+	while True:
+		line = await reader.readline()
+		
+		if not line.endswith(b"\n"):
+			raise ConnectionError("Connection to MPD lost")
+		
+		lines.append(line)
+		
+		if line.startswith(b"binary: "):
+			lines.append(await reader.readexactly(int(line[8:]) + 1))
+		
+		elif line == OK or line.startswith(b"ACK "):
+			return b"".join(lines)
+
+def command(line):
+	"""
+	Name of the command on a request line.
+	"""
+	return line.split(None, 1)[0].decode("utf-8", "replace").lower() if line.strip() else ""
+
+def quote(value):
+	"""
+	Quote an argument for a request line, like python-mpd does.
+	"""
+	return '"{0}"'.format(value.replace("\\", "\\\\").replace('"', '\\"'))
+
+def denied(name):
+	"""
+	MPD's reply to a command the client may not run.
+	"""
+	return 'ACK [4@0] {{{0}}} you don\'t have permission for "{0}"\n'.format(
+		name
+	).encode()
+
+def adjust_elapsed(response, age):
+	"""
+	Move elapsed time in a cached status along while playing,
+	MPD doesn't send idle events for the clock ticking.
+	"""
+	if b"\nstate: play\n" not in b"\n" + response: return response
+	
+	lines = response.split(b"\n")
+	
+	for num, line in enumerate(lines):
+		if line.startswith(b"elapsed: "):
+			elapsed = float(line[9:]) + age
+			lines[num] = "elapsed: {0:.3f}".format(elapsed).encode()
+		
+		elif line.startswith(b"time: "):
+			now, sep, end = line[6:].partition(b":")
+			now = int(int(now) + age)
+			lines[num] = b"time: " + str(now).encode() + b":" + end
+	
+	return b"\n".join(lines)
+
+class Upstream(object):
+	"""
+	The connections to the real MPD server, one for
+	passing through commands and one waiting in idle.
+	"""
+	async def open(self):
+		reader, writer = await asyncio.open_connection(self.host, self.port)
+		
+		hello = await reader.readline()
+		
+		if not hello.startswith(b"OK MPD "):
+			raise ConnectionError("Not an MPD server: {0!r}".format(hello))
+		
+		self.hello = hello
+		
+		if self.password:
+			writer.write("password {0}\n".format(quote(self.password)).encode())
+			await readresponse(reader)
+		
+		return reader, writer
+	
+	async def request(self, data):
+		"""
+		Send request line(s) and return the raw response.
+		Requests are serialized since the connection is shared.
+		"""
+		async with self.lock:
+			for attempt in (1, 2):
+				try:
+					if not self.cmd:
+						self.cmd = await self.open()
+					
+					reader, writer = self.cmd
+					
+					writer.write(data)
+					await writer.drain()
+					
+					return await readresponse(reader)
+				except (ConnectionError, OSError, asyncio.IncompleteReadError):
+					# MPD closes connections that were quiet for too long,
+					# reconnect once.
+					self.cmd = None
+					
+					if attempt == 2: raise
+	
+	async def cached(self, line):
+		"""
+		Serve a cacheable read, from the cache if possible.
+		"""
+		key = line.strip()
+		entry = self.cache.get(key)
+		
+		if entry:
+			response, fetched = entry
+			
+			if command(line) == "status":
+				response = adjust_elapsed(response, time.monotonic() - fetched)
+			
+			self.hits += 1
+			return response
+		
+		generation = self.generation
+		fetched = time.monotonic()
+		
+		response = await self.request(line)
+		
+		# Don't store what went stale while it was being fetched
+		if generation == self.generation and not response.startswith(b"ACK "):
+			self.cache[key] = (response, fetched)
+		
+		self.misses += 1
+		return response
+	
+	def invalidate(self, commands=None):
+		"""
+		Drop cached responses of the given commands, everything if None.
+		"""
+		self.generation += 1
+		
+		if commands is None:
+			self.cache.clear()
+			return
+		
+		for key in list(self.cache):
+			if command(key) in commands:
+				del self.cache[key]
+	
+	async def watch(self):
+		"""
+		Keep the idle connection running and
+		hand the changes to the cache and clients.
+		"""
+		while True:
+			try:
+				reader, writer = await self.open()
+				
+				# Changes may have been missed while disconnected
+				self.invalidate()
+				
+				while True:
+					writer.write(b"idle\n")
+					await writer.drain()
+					
+					response = await readresponse(reader)
+					
+					changed = [
+						line[9:].decode() for line in response.split(b"\n")
+						if line.startswith(b"changed: ")
+					]
+					
+					for subsystem in changed:
+						self.invalidate(INVALIDATES.get(subsystem, ()))
+					
+					for client in self.clients:
+						client.notify(changed)
+			except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+				print("Idle connection lost: {0}, retrying".format(e), file=sys.stderr)
+				self.invalidate()
+				await asyncio.sleep(2)
+	
+	def __init__(self, host, port, password=None):
+		self.host = host
+		self.port = port
+		self.password = password
+		
+		self.hello = b"OK MPD 0.19.0\n"
+		
+		self.cmd = None
+		self.lock = asyncio.Lock()
+		
+		# Command line -> (response, time fetched)
+		self.cache = {}
+		self.generation = 0
+		
+		self.hits = 0
+		self.misses = 0
+		
+		self.clients = set()
+
+class Client(object):
+	"""
+	One client connected to the proxy.
+	"""
+	def notify(self, changed):
+		"""
+		Collect changes like MPD does per client,
+		they're reported on the next idle.
+		"""
+		self.changes.update(changed)
+		self.wakeup.set()
+	
+	async def idle(self, line):
+		"""
+		Answer idle from the collected changes, until
+		something matches or the client sends noidle.
+		"""
+		wanted = set(shlex.split(line.decode())[1:])
+		
+		while True:
+			matched = [
+				subsystem for subsystem in self.changes
+				if not wanted or subsystem in wanted
+			]
+			
+			if matched: break
+			
+			self.wakeup.clear()
+			
+			if not self.nextline:
+				self.nextline = asyncio.ensure_future(self.reader.readline())
+			
+			wakeup = asyncio.ensure_future(self.wakeup.wait())
+			
+			done, pending = await asyncio.wait(
+				(self.nextline, wakeup),
+				return_when=asyncio.FIRST_COMPLETED
+			)
+			
+			wakeup.cancel()
+			
+			if self.nextline in done:
+				# noidle, or the connection was closed
+				if not await self.readline(): raise ConnectionError()
+				
+				return OK
+		
+		self.changes.difference_update(matched)
+		
+		return b"".join(
+			"changed: {0}\n".format(subsystem).encode() for subsystem in matched
+		) + OK
+	
+	async def readline(self):
+		"""
+		Read the next request line. A read started while
+		idling is picked up again instead of being cancelled.
+		"""
+		if not self.nextline:
+			self.nextline = asyncio.ensure_future(self.reader.readline())
+		
+		try: return await self.nextline
+		finally: self.nextline = None
+	
+	async def respond(self, line):
+		"""
+		Build the response for one request.
+		"""
+		name = command(line)
+		
+		# Command lists are read in full first
+		if not self.authorized and name not in (
+			"password", "ping", "noidle",
+			"command_list_begin", "command_list_ok_begin"
+		):
+			return denied(name)
+		
+		if name == "idle":
+			return await self.idle(line)
+		
+		# Only valid while idling, handled in idle()
+		if name == "noidle":
+			return b""
+		
+		# The shared connection is authenticated by the proxy already,
+		# only its own password may use it. Another one MPD accepts
+		# could have fewer permissions.
+		if name == "password":
+			try: password = shlex.split(line.decode())[1]
+			except (ValueError, IndexError):
+				return b'ACK [2@0] {password} wrong number of arguments for "password"\n'
+			
+			if password != self.upstream.password:
+				return b"ACK [3@0] {password} incorrect password\n"
+			
+			self.authorized = True
+			
+			return OK
+		
+		if name in ("command_list_begin", "command_list_ok_begin"):
+			lines = [line]
+			
+			while True:
+				line = await self.readline()
+				
+				if not line: raise ConnectionError()
+				
+				lines.append(line)
+				
+				if command(line) == "command_list_end": break
+			
+			if not self.authorized:
+				return denied(command(lines[1]) if len(lines) > 2 else name)
+			
+			# Sent as one block, so it stays atomic on MPD
+			if any(command(line) not in READONLY + CACHED for line in lines[1:-1]):
+				self.upstream.invalidate()
+			
+			return await self.upstream.request(b"".join(lines))
+		
+		if name in CACHED:
+			return await self.upstream.cached(line)
+		
+		response = await self.upstream.request(line)
+		
+		# Clients expect to see their own changes right away,
+		# don't wait for the idle event.
+		if name not in READONLY:
+			self.upstream.invalidate()
+		
+		return response
+	
+	async def run(self):
+		self.writer.write(self.upstream.hello)
+		
+		try:
+			while True:
+				line = await self.readline()
+				
+				if not line: break
+				
+				if command(line) == "close": break
+				
+				self.writer.write(await self.respond(line))
+				await self.writer.drain()
+		except (ConnectionError, OSError, asyncio.IncompleteReadError):
+			pass
+		finally:
+			self.upstream.clients.discard(self)
+			self.writer.close()
+	
+	def __init__(self, upstream, reader, writer):
+		self.upstream = upstream
+		self.reader = reader
+		self.writer = writer
+		
+		self.changes = set()
+		self.wakeup = asyncio.Event()
+		self.nextline = None
+		
+		# Without a password the shared connection has
+		# no more permissions than the client would.
+		self.authorized = not upstream.password
+		
+		upstream.clients.add(self)
+
+def address(text, defaulthost, defaultport):
+	host, sep, port = text.rpartition(":")
+	
+	if not sep: return text or defaulthost, defaultport
+	
+	return host or defaulthost, int(port)
+
+async def serve(args):
+	host, port = address(args.server, Settings.server, int(Settings.port))
+	upstream = Upstream(host, port, args.password)
+	
+	# Fail early on a wrong server
+	upstream.cmd = await upstream.open()
+	
+	listenhost, listenport = address(args.listen, "127.0.0.1", 6601)
+	
+	server = await asyncio.start_server(
+		lambda reader, writer: Client(upstream, reader, writer).run(),
+		listenhost,
+		listenport
+	)
+	
+	print("Proxying {0}:{1} on {2}:{3}".format(host, port, listenhost, listenport))
+	
+	await asyncio.gather(server.serve_forever(), upstream.watch())
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Caching MPD proxy.")
+	parser.add_argument("-l", "--listen", default="127.0.0.1:6601",
+		help="address to listen on, default 127.0.0.1:6601"
+	)
+	parser.add_argument("-s", "--server", default="",
+		help="MPD server as host:port, default from the Cantapyle settings"
+	)
+	parser.add_argument("-p", "--password", help="MPD password")
+	
+	args = parser.parse_args(argv)
+	
+	try: asyncio.run(serve(args))
+	except KeyboardInterrupt: pass
+	except OSError as e: sys.exit(str(e))
+
+
+
+if __name__ == "__main__":
+	main()
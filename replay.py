@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""
+Stand-in MPD server replaying a recording made with
+"main.py --record FILE".
+
+Every request is answered with the recorded reply to the same
+request, after the recorded delay (scaled by --scale). Repeated
+requests get their replies in the recorded order, the last one is
+repeated once they run out. So the client sees the same data and
+timing on every run, which makes performance comparisons between
+versions reproducible.
+
+Requests that aren't in the recording get an ACK and are counted,
+the summary is printed when the server is stopped.
+
+Examples:
+	replay.py evening.rec
+	replay.py evening.rec --scale 0 --listen 127.0.0.1:6602
+"""
+
+import argparse
+import asyncio
+import json
+import signal
+import sys
+from collections import Counter, deque
+
+from proxy import OK, address, command
+
+class Recording(object):
+	"""
+	The recorded replies, queued per request.
+	"""
+	def load(self, path):
+		with open(path) as file:
+			for line in file:
+				record = json.loads(line)
+				
+				if "hello" in record:
+					if not self.hello:
+						self.hello = record["hello"].encode()
+					continue
+				
+				self.replies.setdefault(record["request"], deque()).append(
+					(record["reply"], record["wait"])
+				)
+	
+	def reply(self, request):
+		"""
+		The next reply to a request and its delay, None if the
+		request was never recorded. Idle has no more replies once
+		they run out, nothing happens after the recording ends.
+		"""
+		replies = self.replies.get(request)
+		
+		if not replies:
+			# Waiting in idle when the recording ended isn't a miss
+			if command(request.encode()) != "idle":
+				self.missed[request.split("\n", 1)[0]] += 1
+			
+			return None
+		
+		if len(replies) > 1 or command(request.encode()) == "idle":
+			reply = replies.popleft()
+		else:
+			reply = replies[0]
+		
+		self.served += 1
+		
+		return reply[0].encode("utf-8", "surrogateescape"), reply[1]
+	
+	def summary(self):
+		lines = ["Served {0} requests, {1} not in the recording".format(
+			self.served,
+			sum(self.missed.values())
+		)]
+		
+		for request, count in self.missed.most_common():
+			lines.append("  {0:>6}  {1}".format(count, request))
+		
+		return "\n".join(lines)
+	
+	def __init__(self, path, scale=1.0):
+		self.hello = b""
+		self.scale = scale
+		
+		# Request -> deque of (reply, wait)
+		self.replies = {}
+		
+		self.served = 0
+		self.missed = Counter()
+		
+		self.load(path)
+		
+		if not self.hello:
+			self.hello = b"OK MPD 0.19.0\n"
+
+async def serve_client(recording, reader, writer):
+	writer.write(recording.hello)
+	
+	try:
+		while True:
+			line = await reader.readline()
+			
+			if not line or command(line) == "close": break
+			
+			lines = [line]
+			
+			# Command lists were recorded as one request
+			if command(line) in ("command_list_begin", "command_list_ok_begin"):
+				while command(lines[-1]) != "command_list_end":
+					line = await reader.readline()
+					
+					if not line: return
+					
+					lines.append(line)
+			
+			request = b"".join(lines).decode("utf-8", "replace")
+			reply = recording.reply(request)
+			
+			if reply is None:
+				# Out of idle events, wait for noidle
+				if command(line) == "idle":
+					if not await reader.readline(): break
+					
+					writer.write(OK)
+				else:
+					writer.write("ACK [5@0] {{{0}}} not in the recording\n".format(
+						command(lines[1] if len(lines) > 1 else lines[0])
+					).encode())
+			else:
+				data, wait = reply
+				
+				if wait * recording.scale > 0:
+					await asyncio.sleep(wait * recording.scale)
+				
+				writer.write(data)
+			
+			await writer.drain()
+	except (ConnectionError, OSError):
+		pass
+	finally:
+		writer.close()
+
+async def serve(args, recording):
+	host, port = address(args.listen, "127.0.0.1", 6600)
+	
+	server = await asyncio.start_server(
+		lambda reader, writer: serve_client(recording, reader, writer),
+		host,
+		port
+	)
+	
+	print("Replaying {0} on {1}:{2}".format(args.recording, host, port))
+	
+	await server.serve_forever()
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Replay a recorded MPD session.")
+	parser.add_argument("recording", help="file written by main.py --record")
+	parser.add_argument("-l", "--listen", default="127.0.0.1:6600",
+		help="address to listen on, default 127.0.0.1:6600"
+	)
+	parser.add_argument("--scale", type=float, default=1.0,
+		help="multiply the recorded delays, 0 answers right away"
+	)
+	
+	args = parser.parse_args(argv)
+	
+	recording = Recording(args.recording, args.scale)
+	
+	# Stopped like Ctrl+C by scripts, so the summary is printed
+	signal.signal(signal.SIGTERM, signal.default_int_handler)
+	
+	try: asyncio.run(serve(args, recording))
+	except KeyboardInterrupt: pass
+	except OSError as e: sys.exit(str(e))
+	
+	print(recording.summary(), file=sys.stderr)
+
+
+
+if __name__ == "__main__":
+	main()